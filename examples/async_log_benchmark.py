@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""async_log_benchmark.py
+
+Measure how many lines/sec of command output run_command can log to a
+MultiFileLogger, writing the logs synchronously versus from
+AsyncLogHandler's writer thread (--async-log).
+
+  examples/async_log_benchmark.py --lines 500000
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.log import LogMixin, MultiFileLogger
+from mozharness.base.script import ScriptMixin
+
+
+class BenchmarkScript(ScriptMixin, LogMixin):
+    def __init__(self, log_dir, async_log, log_to_console):
+        super(BenchmarkScript, self).__init__()
+        self.config = {'log_level': 'info'}
+        self.log_obj = MultiFileLogger(log_dir=log_dir, log_name='bench',
+                                       log_to_console=log_to_console,
+                                       async_log=async_log)
+
+
+def time_it(name, num_lines, async_log, log_to_console, repeat):
+    best = None
+    for _ in range(repeat):
+        log_dir = tempfile.mkdtemp(prefix='async_log_benchmark')
+        try:
+            s = BenchmarkScript(log_dir, async_log, log_to_console)
+            start = time.time()
+            s.run_command(['seq', '1', str(num_lines)])
+            # Count the time to get it all on disk.
+            s.log_obj.flush()
+            elapsed = time.time() - start
+        finally:
+            # BaseLogger.__del__() shuts logging down, so get rid of
+            # this one before the next one starts.
+            del s
+            shutil.rmtree(log_dir)
+        if best is None or elapsed < best:
+            best = elapsed
+    print >> sys.stderr, "%-25s %8.3fs %12d lines/sec" % (
+        name, best, num_lines / max(best, 1e-9))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--lines", dest="lines", type="int", default=200000)
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    parser.add_option("--console", dest="console", action="store_true",
+                      default=False, help="Log to the console too")
+    (options, args) = parser.parse_args()
+    time_it("synchronous", options.lines, False, options.console,
+            options.repeat)
+    time_it("async_log", options.lines, True, options.console,
+            options.repeat)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""config_cache_benchmark.py
+
+Measure how long parse_config_file takes to read every config under
+configs/, without a cache versus with a warm --config-cache-dir.
+
+  examples/config_cache_benchmark.py --repeat 20
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.config import parse_config_file
+
+
+def query_config_files():
+    config_files = []
+    for root, dirs, files in os.walk(os.path.join(sys.path[0], "..", "configs")):
+        for name in files:
+            if name.startswith("test_malformed"):
+                continue
+            if name.endswith(".json") or name.endswith(".py"):
+                config_files.append(os.path.join(root, name))
+    return config_files
+
+
+def time_it(name, config_files, cache_dir, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for config_file in config_files:
+            parse_config_file(config_file, cache_dir=cache_dir)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-25s %8.2fms %8.3fms/file" % (name, best * 1000,
+                                         best * 1000 / len(config_files))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--repeat", dest="repeat", type="int", default=10)
+    (options, args) = parser.parse_args()
+    config_files = query_config_files()
+    cache_dir = tempfile.mkdtemp(prefix='config_cache_benchmark')
+    try:
+        time_it("uncached", config_files, None, options.repeat)
+        time_it("cold cache", config_files, cache_dir, 1)
+        time_it("warm cache", config_files, cache_dir, options.repeat)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
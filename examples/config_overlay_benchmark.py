@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""config_overlay_benchmark.py
+
+Measure the cost of making a per-locale config and repo list from a
+release config, for every locale: deepcopy()ing the config and repos and
+changing the copies, as we had to before ReadOnlyDict locked the whole
+tree, versus ReadOnlyDict.overlay() on the locked config, which shares
+everything but the top level.
+
+"containers" counts the dicts and lists in the per-locale configs that
+aren't shared with the release config, and "bytes" their sys.getsizeof().
+
+  examples/config_overlay_benchmark.py --locales 200
+"""
+
+from copy import deepcopy
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.config import ReadOnlyDict, parse_config_file
+
+
+def deepcopy_locales(config, locales):
+    results = []
+    for locale in locales:
+        locale_config = deepcopy(config)
+        locale_config['locale'] = locale
+        repos = []
+        for repo_dict in deepcopy(config['repos']):
+            repo_dict['repo'] = repo_dict['repo'] % {'user_repo_override': locale}
+            repos.append(repo_dict)
+        results.append((locale_config, repos))
+    return results
+
+
+def overlay_locales(config, locales):
+    results = []
+    for locale in locales:
+        locale_config = config.overlay(locale=locale)
+        repos = []
+        for repo_dict in config['repos']:
+            repos.append(repo_dict.overlay(
+                repo=repo_dict['repo'] % {'user_repo_override': locale}))
+        results.append((locale_config, repos))
+    return results
+
+
+def walk_containers(obj, seen):
+    if not isinstance(obj, (dict, list, tuple)) or id(obj) in seen:
+        return
+    seen[id(obj)] = obj
+    if isinstance(obj, dict):
+        obj = obj.values()
+    for value in obj:
+        walk_containers(value, seen)
+
+
+def time_it(name, func, config, locales, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        results = func(config, locales)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    shared = {}
+    walk_containers(config, shared)
+    new = {}
+    walk_containers(results, new)
+    new = [obj for obj_id, obj in new.items()
+           if obj_id not in shared and not isinstance(obj, tuple)]
+    print "%-25s %8.2fms %10d containers %10d bytes" % (
+        name, best * 1000, len(new), sum([sys.getsizeof(obj) for obj in new]))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--config-file", dest="config_file",
+                      default="single_locale/release_mozilla-release_android.py")
+    parser.add_option("--locales", dest="locales", type="int", default=100)
+    parser.add_option("--repeat", dest="repeat", type="int", default=5)
+    (options, args) = parser.parse_args()
+    config = parse_config_file(options.config_file)
+    locked_config = ReadOnlyDict(config).lock()
+    locales = ['locale%d' % i for i in range(options.locales)]
+    time_it("deepcopy", deepcopy_locales, config, locales, options.repeat)
+    time_it("overlay", overlay_locales, locked_config, locales,
+            options.repeat)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""lazy_log_benchmark.py
+
+Measure the cost of debug messages that are thrown away at the default
+INFO log level, formatted up front versus passed as format arguments or
+a callable, e.g. query_env() logging every variable, retry() logging
+its arguments, or copytree() logging every file.
+
+  examples/lazy_log_benchmark.py --calls 200000
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.log import LogMixin, MultiFileLogger, INFO
+
+
+class BenchmarkObj(LogMixin):
+    def __init__(self, log_obj):
+        self.config = {'log_level': INFO}
+        self.log_obj = log_obj
+
+
+def time_it(name, func, calls, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(calls)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-25s %8.3fs %12d calls/sec" % (name, best, calls / max(best, 1e-9))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--calls", dest="calls", type="int", default=200000)
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    (options, args) = parser.parse_args()
+    log_dir = tempfile.mkdtemp(prefix='lazy_log_benchmark')
+    try:
+        obj = BenchmarkObj(MultiFileLogger(log_dir=log_dir, log_name='bench',
+                                           log_to_console=False))
+        retry_args = (['hg', 'clone', 'https://hg.mozilla.org/mozilla-central', 'build'],)
+        retry_kwargs = {'cwd': '/builds/slave', 'env': dict(os.environ)}
+        command = ['make', '-C', 'objdir', 'package', 'MOZ_PKG_FORMAT=TGZ']
+
+        def eager(calls):
+            for i in xrange(calls):
+                obj.debug("retry: Calling %s with args: %s, kwargs: %s, attempt #%d" %
+                          ('run_command', str(retry_args), str(retry_kwargs), i))
+                obj.debug("Copy/paste: %s" % subprocess.list2cmdline(command))
+
+        def lazy(calls):
+            for i in xrange(calls):
+                obj.debug("retry: Calling %s with args: %s, kwargs: %s, attempt #%d",
+                          'run_command', retry_args, retry_kwargs, i)
+                obj.debug(lambda: "Copy/paste: %s" % subprocess.list2cmdline(command))
+
+        time_it("formatted up front", eager, options.calls, options.repeat)
+        time_it("lazy", lazy, options.calls, options.repeat)
+    finally:
+        shutil.rmtree(log_dir)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""output_parser_benchmark.py
+
+Measure how many lines/sec OutputParser can classify, walking the error
+list entry by entry (the old way) versus the compiled ErrorListMatcher.
+
+  examples/output_parser_benchmark.py --error-list MakefileErrorList build_raw.log
+"""
+
+from optparse import OptionParser
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+import mozharness.base.errors as errors
+from mozharness.base.log import ErrorListMatcher, OutputParser, ERROR
+
+
+def walk_error_list(error_list, line):
+    """The pre-ErrorListMatcher parse_single_line() loop."""
+    for error_check in error_list:
+        if 'substr' in error_check:
+            if error_check['substr'] in line:
+                return error_check
+        elif 'regex' in error_check:
+            if error_check['regex'].search(line):
+                return error_check
+
+
+def time_it(name, func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(lines)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-25s %8.3fs %12d lines/sec" % (name, best, len(lines) / max(best, 1e-9))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] LOGFILE")
+    parser.add_option("--error-list", dest="error_list",
+                      default="MakefileErrorList",
+                      help="Name of the error list in mozharness.base.errors")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Please specify a recorded build log.")
+    error_list = getattr(errors, options.error_list)
+    fh = open(args[0])
+    raw_lines = fh.readlines()
+    fh.close()
+    lines = [line.decode('utf-8', 'replace').rstrip() for line in raw_lines]
+    print "%d lines, %s (%d entries)" % (len(lines), options.error_list,
+                                         len(error_list))
+
+    def walk(lines):
+        for line in lines:
+            walk_error_list(error_list, line)
+
+    def matcher(lines):
+        m = ErrorListMatcher(error_list)
+        for line in lines:
+            m.match(line)
+
+    def output_parser(lines):
+        p = OutputParser(config={'log_level': ERROR}, error_list=error_list,
+                         log_output=False)
+        p.add_lines(lines)
+
+    time_it("walk error_list", walk, lines, options.repeat)
+    time_it("ErrorListMatcher", matcher, lines, options.repeat)
+    time_it("OutputParser.add_lines", output_parser, raw_lines, options.repeat)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""startup_benchmark.py
+
+Measure how long each script in scripts/ takes to start up and exit,
+running it with --list-actions, as unit.sh does.
+
+  examples/startup_benchmark.py --repeat 5
+  examples/startup_benchmark.py --args=--help scripts/b2g_build.py
+"""
+
+from optparse import OptionParser
+import glob
+import os
+import subprocess
+import sys
+import time
+
+
+def time_it(script, script_args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        devnull = open(os.devnull, 'w')
+        try:
+            returncode = subprocess.call([sys.executable, script] + script_args,
+                                         stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, returncode
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [script ...]")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3)
+    parser.add_option("--args", dest="args", default="--list-actions",
+                      help="Arguments to run each script with")
+    (options, args) = parser.parse_args()
+    scripts = args or sorted(glob.glob(os.path.join(
+        os.path.dirname(sys.path[0]), "scripts", "*.py")))
+    total = 0
+    for script in scripts:
+        best, returncode = time_it(script, options.args.split(),
+                                   options.repeat)
+        total += best
+        print "%-45s %8.1fms%s" % (os.path.basename(script), best * 1000,
+                                   returncode and " (exit %d)" % returncode or "")
+    print "%-45s %8.1fms" % ("total", total * 1000)
+
+
+# __main__ {{{1
+if __name__ == '__main__':
+    main()
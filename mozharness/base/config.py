@@ -25,9 +25,12 @@ TODO:
 """
 
 from copy import deepcopy
+import hashlib
+import marshal
 from optparse import OptionParser, Option, OptionGroup
 import os
 import sys
+import time
 try:
     import simplejson as json
 except ImportError:
@@ -62,16 +65,59 @@ class ExtendOption(Option):
 
 
 # ReadOnlyDict {{{1
+def _freeze(value):
+    """Return a locked ReadOnlyDict or ReadOnlyList version of value if
+    it's a dict or list, or value itself if it's already locked or isn't a
+    container.
+    """
+    if isinstance(value, (ReadOnlyDict, ReadOnlyList)) and value._lock:
+        return value
+    if isinstance(value, dict):
+        value = ReadOnlyDict(value)
+    elif isinstance(value, list):
+        value = ReadOnlyList(value)
+    else:
+        return value
+    value.lock()
+    return value
+
+
 class ReadOnlyDict(dict):
+    """A dict that can be locked against changes.
+
+    lock() locks the dicts and lists inside it too, so once locked the
+    whole tree is immutable.  That means locked ReadOnlyDicts can share
+    their values freely: overlay() makes "this config plus these keys"
+    without copying anything but the top level.  copy.copy() and
+    copy.deepcopy() still make unlocked copies to change.
+    """
     def __init__(self, dictionary):
         self._lock = False
-        self.update(dictionary.copy())
+        dict.update(self, dictionary)
 
     def _check_lock(self):
         assert not self._lock, "ReadOnlyDict is locked!"
 
     def lock(self):
-        self._lock = True
+        if not self._lock:
+            for key, value in self.iteritems():
+                dict.__setitem__(self, key, _freeze(value))
+            self._lock = True
+        return self
+
+    def overlay(self, *args, **kwargs):
+        """Return a locked ReadOnlyDict of self, with the keys from
+        args/kwargs set, as with dict.update().
+        """
+        config = ReadOnlyDict(self)
+        dict.update(config, *args, **kwargs)
+        return config.lock()
+
+    def __copy__(self):
+        return ReadOnlyDict(self)
+
+    def __deepcopy__(self, memo):
+        return ReadOnlyDict(deepcopy(dict(self), memo))
 
     def __setitem__(self, *args):
         self._check_lock()
@@ -102,10 +148,171 @@ class ReadOnlyDict(dict):
         dict.update(self, *args)
 
 
+class ReadOnlyList(list):
+    """The list counterpart to ReadOnlyDict."""
+    def __init__(self, iterable=()):
+        self._lock = False
+        list.__init__(self, iterable)
+
+    def _check_lock(self):
+        assert not self._lock, "ReadOnlyList is locked!"
+
+    def lock(self):
+        if not self._lock:
+            for i, value in enumerate(self):
+                list.__setitem__(self, i, _freeze(value))
+            self._lock = True
+        return self
+
+    def __copy__(self):
+        return ReadOnlyList(self)
+
+    def __deepcopy__(self, memo):
+        return ReadOnlyList(deepcopy(list(self), memo))
+
+    def __setitem__(self, *args):
+        self._check_lock()
+        return list.__setitem__(self, *args)
+
+    def __delitem__(self, *args):
+        self._check_lock()
+        return list.__delitem__(self, *args)
+
+    def __setslice__(self, *args):
+        self._check_lock()
+        return list.__setslice__(self, *args)
+
+    def __delslice__(self, *args):
+        self._check_lock()
+        return list.__delslice__(self, *args)
+
+    def __iadd__(self, *args):
+        self._check_lock()
+        return list.__iadd__(self, *args)
+
+    def __imul__(self, *args):
+        self._check_lock()
+        return list.__imul__(self, *args)
+
+    def append(self, *args):
+        self._check_lock()
+        return list.append(self, *args)
+
+    def extend(self, *args):
+        self._check_lock()
+        return list.extend(self, *args)
+
+    def insert(self, *args):
+        self._check_lock()
+        return list.insert(self, *args)
+
+    def pop(self, *args):
+        self._check_lock()
+        return list.pop(self, *args)
+
+    def remove(self, *args):
+        self._check_lock()
+        return list.remove(self, *args)
+
+    def reverse(self, *args):
+        self._check_lock()
+        return list.reverse(self, *args)
+
+    def sort(self, *args, **kwargs):
+        self._check_lock()
+        return list.sort(self, *args, **kwargs)
+
+
+# Config cache {{{1
+CONFIG_CACHE_VERSION = 2
+# How coarse file mtimes can be, in seconds (FAT: 2).  A file whose mtime
+# is this close to when its cache entry was written could have changed
+# since without its mtime changing.
+MTIME_GRANULARITY = 2
+
+
+def query_config_cache_path(cache_dir, file_path):
+    """Where the cached form of file_path lives in cache_dir."""
+    file_path = os.path.realpath(file_path)
+    return os.path.join(cache_dir, "%s.cache" % hashlib.sha1(file_path).hexdigest())
+
+
+def _load_config_file(file_path, contents):
+    """Turn the contents of a config file into the form we cache: the
+    parsed dict for json, or the compiled code for python.
+
+    Python configs are still executed every time, since they're free to
+    look at the cwd, environment, hostname or clock.
+    """
+    if file_path.endswith('.py'):
+        return compile(contents, file_path, 'exec')
+    return dict(json.loads(contents))
+
+
+def read_config_cache(cache_dir, file_path):
+    """Return the cached form of file_path, from cache_dir if it's
+    still good, otherwise freshly parsed (and cached for next time).
+
+    A cache entry is only good for the same resolved path (symlinks
+    followed), size and mtime, with the same python version.  Only if
+    the mtime is too close to when the entry was written to tell (see
+    MTIME_GRANULARITY) do we read the file and compare sha1s.
+    """
+    stat = os.stat(file_path)
+    key = (CONFIG_CACHE_VERSION, sys.version, os.path.realpath(file_path),
+           stat.st_size, stat.st_mtime)
+    try:
+        fh = open(query_config_cache_path(cache_dir, file_path), 'rb')
+        try:
+            cached_key, sha1, written, cached = marshal.load(fh)
+        finally:
+            fh.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        cached_key = sha1 = written = cached = None
+    if cached_key == key and stat.st_mtime < written - MTIME_GRANULARITY:
+        return cached
+    fh = open(file_path, 'rb')
+    try:
+        contents = fh.read()
+    finally:
+        fh.close()
+    if cached_key == key and hashlib.sha1(contents).hexdigest() == sha1:
+        return cached
+    cached = _load_config_file(file_path, contents)
+    write_config_cache(cache_dir, file_path, key,
+                       hashlib.sha1(contents).hexdigest(), cached)
+    return cached
+
+
+def write_config_cache(cache_dir, file_path, key, sha1, cached):
+    """Write the cache entry for file_path, via a temp file so
+    concurrent scripts never see a partial one.
+
+    The cache is only an optimization, so failing to write it is fine.
+    """
+    cache_path = query_config_cache_path(cache_dir, file_path)
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fh = open(tmp_path, 'wb')
+        try:
+            marshal.dump((key, sha1, time.time(), cached), fh)
+        finally:
+            fh.close()
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError, ValueError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 # parse_config_file {{{1
 def parse_config_file(file_name, quiet=False, search_path=None,
-                      config_dict_name="config"):
+                      config_dict_name="config", cache_dir=None):
     """Read a config file and return a dictionary.
+
+    With cache_dir, json configs are parsed and python configs compiled
+    only when they change; see read_config_cache().
     """
     file_path = None
     if os.path.exists(file_name):
@@ -120,19 +327,28 @@ def parse_config_file(file_name, quiet=False, search_path=None,
                 break
         else:
             raise IOError("Can't find %s in %s!" % (file_name, search_path))
+    if not (file_name.endswith('.py') or file_name.endswith('.json')):
+        raise RuntimeError("Unknown config file type %s!" % file_name)
+    if cache_dir:
+        cached = read_config_cache(cache_dir, file_path)
+    else:
+        cached = None
     if file_name.endswith('.py'):
         global_dict = {}
         local_dict = {}
-        execfile(file_path, global_dict, local_dict)
+        if cached is None:
+            execfile(file_path, global_dict, local_dict)
+        else:
+            exec cached in global_dict, local_dict
         config = local_dict[config_dict_name]
-    elif file_name.endswith('.json'):
+    elif cached is not None:
+        config = cached
+    else:
         fh = open(file_path)
         config = {}
         json_config = json.load(fh)
         config = dict(json_config)
         fh.close()
-    else:
-        raise RuntimeError("Unknown config file type %s!" % file_name)
     # TODO return file_path
     return config
 
@@ -165,7 +381,7 @@ class BaseConfig(object):
                 'no_actions': None,
             }
         else:
-            self.volatile_config = deepcopy(volatile_config)
+            self.volatile_config = volatile_config.copy()
 
         if config:
             self.set_config(config)
@@ -195,6 +411,11 @@ class BaseConfig(object):
             "-c", "--config-file", "--cfg", action="extend", dest="config_files",
             type="string", help="Specify the config files"
         )
+        self.config_parser.add_option(
+            "--config-cache-dir", action="store", dest="config_cache_dir",
+            type="string",
+            help="Cache parsed config files in this directory"
+        )
 
         # Logging
         log_option_group = OptionGroup(self.config_parser, "Logging")
@@ -221,6 +442,27 @@ class BaseConfig(object):
             "--simple-log", action="store_const", const="simple",
             dest="log_type", help="Log using SimpleFileLogger"
         )
+        log_option_group.add_option(
+            "--async-log", action="store_true",
+            dest="async_log", default=False,
+            help="Write the logs from a separate thread"
+        )
+        log_option_group.add_option(
+            "--log-store", action="store_true",
+            dest="log_store", default=False,
+            help="Write each line once, and the per-level logs at the end"
+        )
+        log_option_group.add_option(
+            "--log-compression", action="store",
+            type="choice", dest="log_compression",
+            choices=["gzip", "zstd"],
+            help="Compress the logs as they're written (gzip|zstd)"
+        )
+        log_option_group.add_option(
+            "--no-log-index", action="store_false",
+            dest="log_index",
+            help="Don't write an index of the errors, actions and commands in the log"
+        )
         self.config_parser.add_option_group(log_option_group)
 
         # Actions
@@ -243,6 +485,21 @@ class BaseConfig(object):
             dest="no_actions", metavar="ACTIONS",
             help="Don't perform action"
         )
+        action_option_group.add_option(
+            "--profile-actions", action="store_true",
+            dest="profile_actions",
+            help="Time each action, and where the time went, in the log dir"
+        )
+        action_option_group.add_option(
+            "--cprofile-actions", action="store_true",
+            dest="cprofile_actions",
+            help="Like --profile-actions, plus run each action under cProfile"
+        )
+        action_option_group.add_option(
+            "--trace", action="store_true",
+            dest="trace",
+            help="Write a timeline of the actions and commands to trace.json in the log dir"
+        )
         for action in self.all_actions:
             action_option_group.add_option(
                 "--%s" % action, action="append_const",
@@ -315,7 +572,8 @@ class BaseConfig(object):
         else:
             config = {}
             for cf in options.config_files:
-                config.update(parse_config_file(cf))
+                config.update(parse_config_file(
+                    cf, cache_dir=options.config_cache_dir))
             self.set_config(config)
         for key in defaults.keys():
             value = getattr(options, key)
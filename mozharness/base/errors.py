@@ -12,7 +12,10 @@ Each line of output is matched against each substring or regular expression
 in the error list.  On a match, we determine the 'level' of that line,
 whether IGNORE, DEBUG, INFO, WARNING, ERROR, CRITICAL, or FATAL.
 
-TODO: Context lines (requires work on the OutputParser side)
+An entry can also set 'context_lines', e.g. '5:5' or '20:', to mark that
+many lines before:after a match to at least the same level, and
+'abort': True to have run_command kill the command soon after a match
+rather than waiting for it to exit.
 
 TODO: We could also create classes that generate these, but with the
 appropriate level (please don't die on any errors; please die on any
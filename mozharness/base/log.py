@@ -11,11 +11,23 @@ TODO:
 - log rotation config
 """
 
+import atexit
+from collections import deque
 from datetime import datetime
 import logging
 import os
+import re
+import sre_constants
+import sre_parse
 import sys
+import threading
+import time
 import traceback
+import weakref
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 # Define our own FATAL_LEVEL
 FATAL_LEVEL = logging.CRITICAL + 10
@@ -26,6 +38,227 @@ DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL, IGNORE = (
     'debug', 'info', 'warning', 'error', 'critical', 'fatal', 'ignore')
 
 
+# Compressed logs {{{1
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def query_compression(path):
+    """The compression, by file extension, of path, or None."""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+
+
+# gzip and zstandard are imported where they're used, to keep script
+# startup fast.
+def have_zstandard():
+    """Whether the zstandard module, for 'zstd' compression, is there."""
+    try:
+        import zstandard
+        assert zstandard
+    except ImportError:
+        return False
+    return True
+
+
+class ZstdFile(object):
+    """Just enough of a file object to write a zstd stream; flush()
+    ends a block, so everything written so far can be decompressed.
+    """
+    def __init__(self, path, mode='wb'):
+        import zstandard
+        self.zstandard = zstandard
+        self.fh = open(path, mode)
+        self.writer = zstandard.ZstdCompressor().stream_writer(self.fh)
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.writer.write(data)
+
+    def flush(self):
+        self.writer.flush(self.zstandard.FLUSH_BLOCK)
+
+    def close(self):
+        if self.fh is not None:
+            self.writer.flush(self.zstandard.FLUSH_FRAME)
+            self.fh.close()
+            self.fh = None
+
+
+def open_compressed(path, mode='wb'):
+    """Open path for writing, through gzip or zstd if its extension says
+    so.  Appending adds another gzip member or zstd frame, which
+    zcat/zstdcat read straight through.
+    """
+    compression = query_compression(path)
+    if compression == 'gzip':
+        import gzip
+        return gzip.GzipFile(path, mode)
+    if compression == 'zstd':
+        return ZstdFile(path, mode)
+    return open(path, mode)
+
+
+def query_log_size(path):
+    """The number of (uncompressed) bytes and lines in the log at path."""
+    num_bytes = num_lines = 0
+    fh = open(path, 'rb')
+    try:
+        stream = fh
+        compression = query_compression(path)
+        if compression == 'gzip':
+            import gzip
+            stream = gzip.GzipFile(fileobj=fh)
+        elif compression == 'zstd':
+            import zstandard
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                fh, read_across_frames=True)
+        while True:
+            data = stream.read(1024 * 1024)
+            if not data:
+                break
+            num_bytes += len(data)
+            num_lines += data.count('\n')
+    finally:
+        fh.close()
+    return (num_bytes, num_lines)
+
+
+# LogIndex {{{1
+class LogIndex(object):
+    """A sidecar index of a log file, so a log viewer or triage tool can
+    seek straight to the interesting parts of a big log.
+
+    There's a line of json in the index for each WARNING-or-worse line
+    of the log, and each line logged with an index_entry, e.g. where
+    actions and commands start, and which error_list pattern a line
+    matched:
+
+      {"offset": 1234, "line": 56, "level": "error", "pattern": "Error: "}
+      {"offset": 2345, "line": 78, "level": "info", "action": "build"}
+
+    offset is the byte offset where the line starts, and line its
+    1-based line number, in the uncompressed log.  The index is written
+    as the log is, by the log's file handler.
+    """
+    def __init__(self, index_path, log_path=None, append=False):
+        self.offset = 0
+        self.line_number = 0
+        if append and log_path and os.path.exists(log_path):
+            (self.offset, self.line_number) = query_log_size(log_path)
+        mode = 'w'
+        if append:
+            mode = 'a'
+        self.fh = open(index_path, mode)
+
+    def add_lines(self, records, lines):
+        """Note where each of lines, formatted from records, will start
+        in the log; call this just before writing them.
+        """
+        entries = []
+        for record, line in zip(records, lines):
+            index_entry = getattr(record, 'index_entry', None)
+            if record.levelno >= logging.WARNING or index_entry:
+                entry = {
+                    'offset': self.offset,
+                    'line': self.line_number + 1,
+                    'level': record.levelname.lower(),
+                }
+                if index_entry:
+                    entry.update(index_entry)
+                entries.append(json.dumps(entry, sort_keys=True))
+            self.offset += len(line) + 1
+            self.line_number += 1
+        if entries:
+            self.fh.write('\n'.join(entries) + '\n')
+            self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class LogIndexMixin(object):
+    """For log file handlers: with a LogIndex in self.index, note where
+    each record will start in the log as it's written.
+    """
+    index = None
+
+    def emit(self, record):
+        if self.index is None:
+            return super(LogIndexMixin, self).emit(record)
+        try:
+            line = self.format(record)
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            self.index.add_lines([record], [line])
+            self.stream.write(line + '\n')
+            self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        super(LogIndexMixin, self).close()
+
+
+class IndexedFileHandler(LogIndexMixin, logging.FileHandler):
+    pass
+
+
+class CompressedFileHandler(LogIndexMixin, logging.StreamHandler):
+    """A FileHandler for a .gz or .zst log.
+
+    Compressed data only becomes readable at a sync point, and each one
+    costs some compression, so rather than on every record like a
+    FileHandler, this only flushes every sync_interval seconds.  A log
+    that's cut off, e.g. by a killed job, is then readable up to the
+    last sync point.  Closing the handler, or finish_stream(), leaves a
+    complete file.
+    """
+    def __init__(self, log_path, mode='ab', sync_interval=5):
+        self.baseFilename = os.path.abspath(log_path)
+        self.sync_interval = sync_interval
+        self.last_sync_time = time.time()
+        logging.StreamHandler.__init__(self, open_compressed(log_path, mode))
+
+    def flush(self):
+        now = time.time()
+        if now - self.last_sync_time >= self.sync_interval:
+            self.last_sync_time = now
+            logging.StreamHandler.flush(self)
+
+    def finish_stream(self):
+        """End the gzip member or zstd frame, so the file is complete
+        as it stands, e.g. to upload it; anything logged after goes into
+        a new one.
+        """
+        self.acquire()
+        try:
+            if self.stream:
+                self.stream.close()
+                self.stream = open_compressed(self.baseFilename, 'ab')
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            LogIndexMixin.close(self)
+        finally:
+            self.release()
+
+
 # LogMixin {{{1
 class LogMixin(object):
     """This is a mixin for any object to access similar logging
@@ -47,8 +280,39 @@ class LogMixin(object):
             else:
                 print message
 
-    def log(self, message, level=INFO, exit_code=-1):
+    def _is_enabled_for(self, level):
+        """Whether a message at level will be logged anywhere."""
+        if level == IGNORE:
+            return False
+        if self.log_obj and hasattr(self.log_obj, 'is_enabled_for'):
+            return self.log_obj.is_enabled_for(level)
+        return self._log_level_at_least(level)
+
+    def log(self, message, level=INFO, exit_code=-1, args=None,
+            index_entry=None):
+        """Log message at level.
+
+        To skip the work of building a message that won't be logged,
+        message can be a format string for args, e.g.
+        self.log("%s is now %s", level=DEBUG, args=(key, value)),
+        or a callable that returns the message.  Either way it's only
+        formatted if the level is enabled.
+
+        index_entry is a dict for the log index, if self.log_obj keeps
+        one; see LogIndex.
+        """
+        if args or callable(message):
+            if level != FATAL and not self._is_enabled_for(level):
+                return
+            if callable(message):
+                message = message()
+            if args:
+                message = message % args
         if self.log_obj:
+            if index_entry and getattr(self.log_obj, 'log_index', False):
+                return self.log_obj.log_message(message, level=level,
+                                                exit_code=exit_code,
+                                                index_entry=index_entry)
             return self.log_obj.log_message(message, level=level,
                                             exit_code=exit_code)
         if level == INFO:
@@ -78,100 +342,455 @@ class LogMixin(object):
         # Log at the end, as a fatal will attempt to exit after the 1st line.
         self.log(message, level=level)
 
-    def debug(self, message):
-        self.log(message, level=DEBUG)
+    def _log_args(self, message, level, args):
+        # Leave args out when there aren't any, for subclasses that
+        # override log() the old way.
+        if args:
+            self.log(message, level=level, args=args)
+        else:
+            self.log(message, level=level)
+
+    def debug(self, message, *args):
+        self._log_args(message, DEBUG, args)
 
-    def info(self, message):
-        self.log(message, level=INFO)
+    def info(self, message, *args):
+        self._log_args(message, INFO, args)
 
-    def warning(self, message):
-        self.log(message, level=WARNING)
+    def warning(self, message, *args):
+        self._log_args(message, WARNING, args)
 
-    def error(self, message):
-        self.log(message, level=ERROR)
+    def error(self, message, *args):
+        self._log_args(message, ERROR, args)
 
-    def critical(self, message):
-        self.log(message, level=CRITICAL)
+    def critical(self, message, *args):
+        self._log_args(message, CRITICAL, args)
 
     def fatal(self, message, exit_code=-1):
         self.log(message, level=FATAL, exit_code=exit_code)
 
+
+# ErrorListMatcher {{{1
+def _required_literals(subpattern):
+    """Return a list of strings, one of which has to appear in any string
+    matched by the parsed regex |subpattern|, or None if we can't tell.
+
+    We only look at literal runs, groups, branches and repeats with a
+    minimum of 1; anything else just ends the current literal run.
+    """
+    candidates = []
+    run = []
+    for op, av in subpattern:
+        if op == sre_constants.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            candidates.append([run])
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            candidates.append(_required_literals(av[-1]))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if av[0] >= 1:
+                candidates.append(_required_literals(av[-1]))
+        elif op == sre_constants.BRANCH:
+            alternatives = []
+            for branch in av[-1]:
+                branch_literals = _required_literals(branch)
+                if branch_literals is None:
+                    alternatives = None
+                    break
+                alternatives.extend(branch_literals)
+            candidates.append(alternatives)
+    if run:
+        candidates.append([run])
+    best = None
+    for candidate in candidates:
+        if not candidate:
+            continue
+        candidate = [''.join([chr(c) for c in s])
+                     if isinstance(s, list) else s for s in candidate]
+        if best is None or min(map(len, candidate)) > min(map(len, best)):
+            best = candidate
+    return best
+
+
+def _literal_trie_regex(literals):
+    """Build a single regex matching any of |literals|, factored into a
+    trie so the regex engine can rule out most positions by their first
+    character instead of trying every alternative.
+    """
+    # If one literal contains another, the shorter one is enough.
+    literals = sorted(set(literals), key=len)
+    minimal = []
+    for literal in literals:
+        for shorter in minimal:
+            if shorter in literal:
+                break
+        else:
+            minimal.append(literal)
+    trie = {}
+    for literal in minimal:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+
+    def build(node):
+        branches = [re.escape(char) + build(node[char])
+                    for char in sorted(node)]
+        if len(branches) <= 1:
+            return ''.join(branches)
+        return '(?:%s)' % '|'.join(branches)
+    return build(trie)
+
+
+def parse_context_lines(context_lines):
+    """Turn an error_list 'context_lines' value into a tuple of
+    (num_pre_context_lines, num_post_context_lines).
+
+    '5:5' is five lines before and after, '20:' is 20 lines before, ':3'
+    is three lines after.  A plain number N means 'N:N'.
+    """
+    if not context_lines:
+        return (0, 0)
+    if isinstance(context_lines, int):
+        return (context_lines, context_lines)
+    if ':' not in context_lines:
+        return (int(context_lines), int(context_lines))
+    pre, post = context_lines.split(':', 1)
+    return (int(pre or 0), int(post or 0))
+
+
+class ErrorListMatcher(object):
+    """Compiled form of an error_list, as used by OutputParser.
+
+    Lines are matched as utf-8 bytes, so unicode substrings and regexes
+    are encoded up front.
+
+    The error_list is searched in order and the first matching entry wins,
+    same as walking the list by hand.  Since the vast majority of lines
+    match nothing, we first run the line through a single prefilter regex
+    built from the substrings plus a literal that each regex requires; only
+    lines that get past it are checked entry by entry.
+
+    If we can't find a required literal for one of the regexes (e.g.
+    case-insensitive ones), there's no prefilter and every line is checked
+    entry by entry.
+
+    Entries with neither 'substr' nor 'regex' are skipped and listed in
+    self.invalid_entries.  self.num_pre_context_lines is the largest
+    pre-context in the error_list, i.e. how many lines OutputParser needs
+    to hold back.  self.has_abort is set if any entry is marked 'abort'.
+    """
+    def __init__(self, error_list):
+        self.error_list = error_list
+        self.length = len(error_list)
+        self.invalid_entries = []
+        self.num_pre_context_lines = 0
+        self.has_abort = False
+        checks = []
+        literals = []
+        for error_check in error_list:
+            if error_check.get('abort'):
+                self.has_abort = True
+            if error_check.get('context_lines'):
+                pre, post = parse_context_lines(error_check['context_lines'])
+                self.num_pre_context_lines = max(pre, self.num_pre_context_lines)
+            if 'substr' in error_check:
+                substr = error_check['substr']
+                if isinstance(substr, unicode):
+                    substr = substr.encode('utf-8')
+                checks.append((substr, None, error_check))
+                if literals is not None:
+                    literals.append(substr)
+            elif 'regex' in error_check:
+                regex = error_check['regex']
+                if isinstance(regex.pattern, unicode):
+                    regex = re.compile(regex.pattern.encode('utf-8'),
+                                       regex.flags)
+                checks.append((None, regex.search, error_check))
+                required = self._query_regex_literals(regex)
+                if required is None:
+                    # Every line needs the full check anyway.
+                    literals = None
+                elif literals is not None:
+                    literals.extend(required)
+            else:
+                self.invalid_entries.append(error_check)
+        self.checks = tuple(checks)
+        self.prefilter = None
+        if literals and '' not in literals:
+            try:
+                self.prefilter = re.compile(_literal_trie_regex(literals)).search
+            except (UnicodeError, sre_constants.error):
+                pass
+
+    def _query_regex_literals(self, regex):
+        if regex.flags & re.IGNORECASE:
+            return None
+        try:
+            return _required_literals(sre_parse.parse(regex.pattern,
+                                                      regex.flags))
+        except (sre_constants.error, TypeError, ValueError):
+            return None
+
+    def match(self, line):
+        """Return the first error_list entry that matches line, or None.
+        """
+        if self.prefilter is not None and not self.prefilter(line):
+            return None
+        for substr, search, error_check in self.checks:
+            if substr is not None:
+                if substr in line:
+                    return error_check
+            elif search(line):
+                return error_check
+        return None
+
+    def is_current(self, error_list):
+        """Whether this matcher still reflects error_list."""
+        return error_list is self.error_list and len(error_list) == self.length
+
+
+# SummaryStore {{{1
+SUMMARY_PATH_REGEX = re.compile(r'(?:[A-Za-z]:)?(?:[\w.~+-]*[/\\])+[\w.~+-]*')
+SUMMARY_NUMBER_REGEX = re.compile(r'\b0x[0-9a-fA-F]+\b|\d+')
+
+
+def normalize_summary(message):
+    """Reduce a summary message to a key that its repeats share, by
+    replacing paths with <path> and numbers with N.
+    """
+    message = SUMMARY_PATH_REGEX.sub('<path>', message)
+    return SUMMARY_NUMBER_REGEX.sub('N', message)
+
+
+class SummaryStore(object):
+    """Bounded, deduplicated store of summary messages, as added via
+    add_summary().
+
+    Messages are grouped by level and normalize_summary() key.  For each
+    key we count the messages and keep the first max_exemplars of them,
+    cut to max_message_length.  Once there are max_keys keys, messages
+    with new keys are only counted in self.num_dropped, so the same error
+    50,000 times, or 50,000 different ones, can't blow up memory or
+    summary().
+    """
+    def __init__(self, max_keys=200, max_exemplars=3,
+                 max_message_length=1000):
+        self.max_keys = max_keys
+        self.max_exemplars = max_exemplars
+        self.max_message_length = max_message_length
+        self.entries = []
+        self.entries_by_key = {}
+        self.num_messages = 0
+        self.num_dropped = 0
+        self.lock = threading.Lock()
+
+    def add(self, message, level=INFO):
+        """Add message; return False if it was dropped because the store
+        is full.
+        """
+        key = (level, normalize_summary(message))
+        self.lock.acquire()
+        try:
+            self.num_messages += 1
+            entry = self.entries_by_key.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_keys:
+                    self.num_dropped += 1
+                    return False
+                entry = {'key': key[1], 'level': level, 'count': 0,
+                         'exemplars': []}
+                self.entries.append(entry)
+                self.entries_by_key[key] = entry
+            entry['count'] += 1
+            if len(entry['exemplars']) < self.max_exemplars:
+                if len(message) > self.max_message_length:
+                    message = message[:self.max_message_length] + '...'
+                entry['exemplars'].append(message)
+            return True
+        finally:
+            self.lock.release()
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return self.num_messages
+
+
 # OutputParser {{{1
 class OutputParser(LogMixin):
     """ Helper object to parse command output.
 
-This will buffer output if needed, so we can go back and mark
-[(linenum - 10):linenum+10] as errors if need be, without having to
-get all the output first.
-
-linenum+10 will be easy; we can set self.num_post_context_lines to 10,
-and self.num_post_context_lines-- as we mark each line to at least error
-level X.
-
-linenum-10 will be trickier. We'll not only need to save the line
-itself, but also the level that we've set for that line previously,
-whether by matching on that line, or by a previous line's context.
-We should only log that line if all output has ended (self.finish() ?);
-otherwise store a list of dictionaries in self.context_buffer that is
-buffered up to self.num_pre_context_lines (set to the largest
-pre-context-line setting in error_list.)
+Error list entries can set 'context_lines' (e.g. '5:5', '20:') to mark
+the lines around a match to at least the level of the match.
+
+Post-context is easy: we set self.num_post_context_lines and count it
+down as we mark each following line to at least self.post_context_level.
+
+For pre-context, we hold back the last self.num_pre_context_lines
+[message, level, summary, index_entry] records (the largest pre-context
+setting in error_list) in self.context_buffer, a deque, so a match can
+still raise their level before they're logged.  The oldest record is logged as each
+new line comes in; call self.finish() once all output has ended to log
+the rest.  With no pre-context in the error_list, lines are logged
+immediately, as before.
+
+Lines logged directly via self.log() bypass the buffer, so they may
+come out ahead of held-back lines.
+
+The first line to match an entry marked 'abort': True is kept in
+self.abort_line, and the entry in self.abort_error_check; run_command
+watches for that to kill the command early.
+
+If self.log_obj keeps a log index, WARNING-or-worse matches go into it
+with the 'substr' or regex they matched, as 'pattern'; see LogIndex.
+
+Lines matching an entry marked 'summary': True also go into
+self.summary_store, a SummaryStore, if set; run_command hands parsers
+the script's.
 """
-    def __init__(self, config=None, log_obj=None, error_list=None, log_output=True):
+    def __init__(self, config=None, log_obj=None, error_list=None,
+                 log_output=True, summary_store=None):
         self.config = config
         self.log_obj = log_obj
         self.error_list = error_list or []
         self.log_output = log_output
+        self.summary_store = summary_store
         self.num_errors = 0
         self.num_warnings = 0
-        # TODO context_lines.
-        # Not in use yet, but will be based off error_list.
-        self.context_buffer = []
+        self.context_buffer = deque()
         self.num_pre_context_lines = 0
         self.num_post_context_lines = 0
+        self.post_context_level = INFO
         self.worst_log_level = INFO
+        self.matcher = None
+        self.abort_error_check = None
+        self.abort_line = None
 
-    def parse_single_line(self, line):
-        for error_check in self.error_list:
-            # TODO buffer for context_lines.
-            match = False
-            if 'substr' in error_check:
-                if error_check['substr'] in line:
-                    match = True
-            elif 'regex' in error_check:
-                if error_check['regex'].search(line):
-                    match = True
-            else:
+    def query_matcher(self):
+        """Compile self.error_list into an ErrorListMatcher, if we haven't
+        already.  If self.error_list has been replaced or grown since, we
+        recompile.
+        """
+        if self.matcher is None or not self.matcher.is_current(self.error_list):
+            self.matcher = ErrorListMatcher(self.error_list)
+            for error_check in self.matcher.invalid_entries:
                 self.warning("error_list: 'substr' and 'regex' not in %s" %
                              error_check)
-            if match:
-                log_level = error_check.get('level', INFO)
-                if self.log_output:
-                    message = ' %s' % line
-                    if error_check.get('explanation'):
-                        message += '\n %s' % error_check['explanation']
-                    if error_check.get('summary'):
-                        self.add_summary(message, level=log_level)
-                    else:
-                        self.log(message, level=log_level)
-                if log_level in (ERROR, CRITICAL, FATAL):
-                    self.num_errors += 1
-                if log_level == WARNING:
-                    self.num_warnings += 1
-                self.worst_log_level = self.worst_level(log_level,
-                                                        self.worst_log_level)
-                break
-        else:
+            self.num_pre_context_lines = self.matcher.num_pre_context_lines
+            while len(self.context_buffer) > self.num_pre_context_lines:
+                self._emit_line(*self.context_buffer.popleft())
+        return self.matcher
+
+    def parse_single_line(self, line):
+        error_check = self.query_matcher().match(line)
+        if error_check is None:
             if self.log_output:
-                self.info(' %s' % line)
+                level = INFO
+                if self.num_post_context_lines:
+                    level = self.worst_level(self.post_context_level, level)
+                    self.num_post_context_lines -= 1
+                self._log_line(' %s' % line, level)
+            return
+        log_level = error_check.get('level', INFO)
+        if error_check.get('abort') and self.abort_error_check is None:
+            self.abort_error_check = error_check
+            self.abort_line = line
+        if log_level in (ERROR, CRITICAL, FATAL):
+            self.num_errors += 1
+        if log_level == WARNING:
+            self.num_warnings += 1
+        self.worst_log_level = self.worst_level(log_level,
+                                                self.worst_log_level)
+        if not self.log_output:
+            return
+        message = ' %s' % line
+        if error_check.get('explanation'):
+            message += '\n %s' % error_check['explanation']
+        level = log_level
+        if self.num_post_context_lines:
+            level = self.worst_level(self.post_context_level, level)
+            self.num_post_context_lines -= 1
+        index_entry = None
+        if log_level in (WARNING, ERROR, CRITICAL, FATAL) and \
+                getattr(self.log_obj, 'log_index', False):
+            pattern = error_check.get('substr')
+            if pattern is None:
+                pattern = error_check['regex'].pattern
+            if isinstance(pattern, str):
+                pattern = pattern.decode('utf-8', 'replace')
+            index_entry = {'pattern': pattern}
+        if error_check.get('context_lines'):
+            pre, post = parse_context_lines(error_check['context_lines'])
+            if pre:
+                for record in list(self.context_buffer)[-pre:]:
+                    record[1] = self.worst_level(log_level, record[1])
+            if post:
+                if self.num_post_context_lines:
+                    self.post_context_level = self.worst_level(
+                        log_level, self.post_context_level)
+                else:
+                    self.post_context_level = log_level
+                self.num_post_context_lines = max(
+                    post, self.num_post_context_lines)
+        self._log_line(message, level, summary=error_check.get('summary'),
+                       index_entry=index_entry)
+
+    def _log_line(self, message, level, summary=False, index_entry=None):
+        if not self.num_pre_context_lines:
+            self._emit_line(message, level, summary, index_entry)
+            return
+        if len(self.context_buffer) >= self.num_pre_context_lines:
+            self._emit_line(*self.context_buffer.popleft())
+        self.context_buffer.append([message, level, summary, index_entry])
+        if level == FATAL:
+            # Don't hold back a fatal line waiting for more output.
+            self.finish()
+
+    def _emit_line(self, message, level, summary=False, index_entry=None):
+        if isinstance(message, str) and self._is_logged(level):
+            message = message.decode('utf-8', 'replace')
+        if summary and self.summary_store is not None:
+            self.summary_store.add(message.strip(), level=level)
+        if index_entry:
+            self.log(message, level=level, index_entry=index_entry)
+        else:
+            self.log(message, level=level)
+
+    def _is_logged(self, level):
+        """Whether a line at level will actually make it to the log, so
+        it's worth decoding.
+        """
+        if level == IGNORE or not self.log_output:
+            return False
+        if not self.config:
+            return level != DEBUG
+        return self._log_level_at_least(level)
+
+    def finish(self):
+        """Log any lines still held back for pre-context.
+        Call this once all output has been added.
+        """
+        while self.context_buffer:
+            self._emit_line(*self.context_buffer.popleft())
+        self.num_post_context_lines = 0
 
     def add_lines(self, output):
+        """Parse a line or a list of lines of output.
+
+        Lines are matched as undecoded utf-8 bytes; only the ones that get
+        logged are decoded.
+        """
         if isinstance(output, basestring):
             output = [output]
+        parse_single_line = self.parse_single_line
         for line in output:
-            if not line or line.isspace():
-                continue
-            line = line.decode("utf-8", 'replace').rstrip()
-            self.parse_single_line(line)
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            line = line.rstrip()
+            if line:
+                parse_single_line(line)
 
     def worst_level(self, target_level, existing_level, levels=None):
         """returns either existing_level or target level.
@@ -186,6 +805,236 @@ pre-context-line setting in error_list.)
                 return l
 
 
+# CaptureParser {{{1
+class CaptureParser(OutputParser):
+    """Pick named values out of command output as it goes by, rather than
+    saving the output and re-scanning it afterwards.
+
+    capture_list example:
+    [{'name': 'buildid', 'regex': re.compile(r'^buildid (\d+)')},
+     {'name': 'upload_url', 'regex': re.compile(r'(http.*\.apk)'), 'keep': 'last'},
+     {'name': 'warning', 'regex': re.compile(r'^WARNING: (.*)'), 'keep': 'all'},
+    ]
+
+    'keep' is 'first' (the default), 'last' or 'all'.  The value of a match
+    is group(1) if the regex has one group, groups() if it has more, or
+    the whole match otherwise.  Values are utf-8 bytes, like the lines.
+
+    This never logs anything itself; run_command feeds it alongside the
+    parser that does.
+    """
+    def __init__(self, capture_list, config=None, log_obj=None):
+        OutputParser.__init__(self, config=config, log_obj=log_obj,
+                              log_output=False)
+        self.capture_list = capture_list
+        self.captures = {}
+        self.active_captures = []
+        for capture in capture_list:
+            keep = capture.get('keep', 'first')
+            if keep not in ('first', 'last', 'all'):
+                raise ValueError("capture_list: bad 'keep' %s in %s" %
+                                 (keep, capture))
+            regex = capture['regex']
+            if isinstance(regex.pattern, unicode):
+                regex = re.compile(regex.pattern.encode('utf-8'), regex.flags)
+            if keep == 'all':
+                self.captures[capture['name']] = []
+            else:
+                self.captures[capture['name']] = None
+            self.active_captures.append((capture['name'], regex.search,
+                                         regex.groups, keep))
+
+    def parse_single_line(self, line):
+        for capture in self.active_captures:
+            name, search, num_groups, keep = capture
+            m = search(line)
+            if m is None:
+                continue
+            if num_groups == 1:
+                value = m.group(1)
+            elif num_groups:
+                value = m.groups()
+            else:
+                value = m.group(0)
+            if keep == 'all':
+                self.captures[name].append(value)
+            else:
+                self.captures[name] = value
+                if keep == 'first':
+                    # Nothing more to look for.
+                    self.active_captures = [c for c in self.active_captures
+                                            if c is not capture]
+
+    def add_lines(self, output):
+        if self.active_captures:
+            OutputParser.add_lines(self, output)
+
+
+# TraceParser {{{1
+class TraceParser(OutputParser):
+    """Note the time of each line of command output that matches one of
+    phase_markers (regexes, or strings to compile), e.g. make's
+    "Entering directory" lines or a test harness's suite headers, so
+    BaseScript can show where the time in a long command went; see
+    BaseScript.dump_trace().  A marker of '^' matches every line.
+
+    self.marks is a list of (time.time(), line) tuples.  Like
+    CaptureParser this never logs anything; run_command feeds it
+    alongside the parser that does.  Lines are timed as they're read,
+    so this is only meaningful when the output is parsed as it comes.
+    """
+    def __init__(self, phase_markers, config=None, log_obj=None):
+        OutputParser.__init__(self, config=config, log_obj=log_obj,
+                              log_output=False)
+        self.searches = []
+        for marker in phase_markers:
+            if isinstance(marker, basestring):
+                marker = re.compile(marker)
+            if isinstance(marker.pattern, unicode):
+                marker = re.compile(marker.pattern.encode('utf-8'),
+                                    marker.flags)
+            self.searches.append(marker.search)
+        self.marks = []
+
+    def parse_single_line(self, line):
+        for search in self.searches:
+            if search(line):
+                self.marks.append((time.time(), line))
+                return
+
+
+# AsyncLogHandler {{{1
+def make_log_record(logger_name, created, levelno, message,
+                    index_entry=None):
+    """A LogRecord for a line logged at time.time() created."""
+    record = logging.LogRecord(logger_name, levelno, '', 0, message,
+                               None, None)
+    if index_entry:
+        record.index_entry = index_entry
+    record.created = created
+    record.msecs = (created - long(created)) * 1000
+    record.relativeCreated = (created - logging._startTime) * 1000
+    return record
+
+
+class AsyncLogHandler(logging.Handler):
+    """Queue records up for a writer thread, which formats them for the
+    handlers in self.targets and writes them out in batches, instead of
+    the logging call writing to every log file itself.
+
+    BaseLogger.log_message() skips the logging machinery and calls
+    self.add_record() with just the time, level and line; the writer
+    makes the LogRecord.
+
+    The writer wakes every flush_interval seconds rather than for every
+    record, so it isn't fighting the thread doing the logging for the
+    GIL.  Once queue_size records are waiting, the logging thread writes
+    them itself.  flush() writes everything queued so far before it
+    returns; BaseLogger flushes before exiting on FATAL, and every
+    AsyncLogHandler is flushed at exit.
+    """
+    def __init__(self, logger_name, queue_size=10000, flush_interval=0.1):
+        logging.Handler.__init__(self)
+        self.logger_name = logger_name
+        self.targets = []
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        # deque.append() and popleft() are thread-safe; write_lock keeps
+        # batches in order.
+        self.records = deque()
+        self.write_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self._write_records,
+                                       name='AsyncLogHandler')
+        self.writer.daemon = True
+        self.writer.start()
+        _async_log_handlers.add(self)
+
+    def add_target(self, handler):
+        self.targets.append(handler)
+
+    def emit(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.queue_size or self.stopped.is_set():
+            self.flush()
+
+    def add_record(self, levelno, message, index_entry=None):
+        self.records.append((time.time(), levelno, message, index_entry))
+        if len(self.records) >= self.queue_size or self.stopped.is_set():
+            self.flush()
+
+    def flush(self):
+        self.write_lock.acquire()
+        try:
+            records = []
+            try:
+                while True:
+                    records.append(self.records.popleft())
+            except IndexError:
+                pass
+            if records:
+                self._write(records)
+        finally:
+            self.write_lock.release()
+
+    def close(self):
+        self.stopped.set()
+        if self.writer.is_alive() and \
+                self.writer is not threading.current_thread():
+            self.writer.join()
+        self.flush()
+        _async_log_handlers.discard(self)
+        logging.Handler.close(self)
+
+    def _write_records(self):
+        while not self.stopped.is_set():
+            self.stopped.wait(self.flush_interval)
+            self.flush()
+
+    def _write(self, records):
+        records = [r if isinstance(r, logging.LogRecord)
+                   else make_log_record(self.logger_name, *r)
+                   for r in records]
+        for target in self.targets:
+            lines = []
+            written_records = []
+            for record in records:
+                if record.levelno < target.level or not target.filter(record):
+                    continue
+                try:
+                    line = target.format(record)
+                    if isinstance(line, unicode):
+                        line = line.encode('utf-8')
+                    lines.append(line)
+                    written_records.append(record)
+                except Exception:
+                    target.handleError(record)
+            if not lines:
+                continue
+            target.acquire()
+            try:
+                if getattr(target, 'index', None) is not None:
+                    target.index.add_lines(written_records, lines)
+                target.stream.write('\n'.join(lines) + '\n')
+                target.flush()
+            except Exception:
+                target.handleError(records[-1])
+            finally:
+                target.release()
+
+
+_async_log_handlers = weakref.WeakSet()
+
+
+def _flush_async_log_handlers():
+    # Registered after logging's own shutdown hook, so this runs first,
+    # while the log files are still open.
+    for handler in list(_async_log_handlers):
+        handler.flush()
+
+atexit.register(_flush_async_log_handlers)
+
+
 # BaseLogger {{{1
 class BaseLogger(object):
     """Create a base logging class.
@@ -193,7 +1042,30 @@ class BaseLogger(object):
     either logging or config that allows you to count the number of
     error,critical,fatal messages for us to count up at the end (aiming
     for 0).
+
+    With async_log, the console and log file handlers are fed by an
+    AsyncLogHandler, so logging doesn't wait on the writes.
+
+    With log_compression 'gzip' or 'zstd', the log files are written
+    compressed, with .gz or .zst added to their names; see
+    CompressedFileHandler.  Without the zstandard module, 'zstd' means
+    'gzip'.
+
+    With log_store, each line is written once, with its level and time,
+    to LOG_NAME_store.log, and the log files are only written from that
+    by write_derived_logs().  BaseScript does that before uploading the
+    logs; it's also done on FATAL and when the logger goes away.  With
+    append_to_log, the store is appended to and the log files are
+    rewritten from all of it.
+
+    With log_index, the main log (the one with every level we log) gets
+    a LogIndex, LOG_FILE.index, as self.log_files['index'].  Lines can
+    be logged with an index_entry dict to add to the index; log objects
+    that take index_entry have log_index set.  With log_store, the index
+    only has the WARNING-or-worse lines.
     """
+    STORE_FORMAT = '%(levelno)d %(created).6f %(message)s'
+
     LEVELS = {DEBUG: logging.DEBUG,
               INFO: logging.INFO,
               WARNING: logging.WARNING,
@@ -212,6 +1084,10 @@ class BaseLogger(object):
                  logger_name='',
                  halt_on_failure=True,
                  append_to_log=False,
+                 async_log=False,
+                 log_store=False,
+                 log_compression=None,
+                 log_index=False,
                 ):
         self.halt_on_failure = halt_on_failure,
         self.log_format = log_format
@@ -222,6 +1098,18 @@ class BaseLogger(object):
         self.log_name = log_name
         self.log_dir = log_dir
         self.append_to_log = append_to_log
+        self.async_log = async_log
+        self.async_handler = None
+        self.log_store = log_store
+        if log_compression == 'zstd' and not have_zstandard():
+            log_compression = 'gzip'
+        if log_compression not in COMPRESSION_EXTENSIONS and \
+                log_compression is not None:
+            raise ValueError("Unknown log_compression %s!" % log_compression)
+        self.log_compression = log_compression
+        self.log_index = log_index
+        self.store_path = None
+        self.derived_logs = {}
 
         # Not sure what I'm going to use this for; useless unless we
         # can have multiple logging objects that don't trample each other
@@ -247,6 +1135,11 @@ class BaseLogger(object):
                          (name, datetime.now().strftime("%Y%m%d %H:%M:%S"),
                          os.getcwd()))
 
+    def is_enabled_for(self, level):
+        if level == IGNORE:
+            return False
+        return self.logger.isEnabledFor(self.get_logger_level(level))
+
     def get_logger_level(self, level=None):
         if not level:
             level = self.log_level
@@ -266,13 +1159,77 @@ class BaseLogger(object):
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(self.get_logger_level())
         self._clear_handlers()
+        if self.async_log:
+            self.async_handler = AsyncLogHandler(logger_name)
+            self.logger.addHandler(self.async_handler)
+            self.all_handlers.append(self.async_handler)
+        if self.log_store:
+            self.store_path = os.path.join(self.abs_log_dir,
+                                           '%s_store.log' % self.log_name)
+            self.derived_logs = {}
+            self.add_file_handler(self.store_path,
+                                  log_format=self.STORE_FORMAT)
         if self.log_to_console:
             self.add_console_handler()
         if self.log_to_raw:
-            self.log_files['raw'] = '%s_raw.log' % self.log_name
-            self.add_file_handler(os.path.join(self.abs_log_dir,
-                                               self.log_files['raw']),
-                                 log_format='%(message)s')
+            self.add_log_file('raw', '%s_raw.log' % self.log_name,
+                              log_format='%(message)s')
+
+    def add_log_file(self, key, file_name, log_level=None, log_format=None,
+                     main_log=False):
+        """Log to file_name in the log dir, as self.log_files[key]; with
+        log_store, it's written later by write_derived_logs().  With
+        log_compression, the extension is added to file_name.  With
+        log_index, the main_log gets an index.
+        """
+        index_path = None
+        if main_log and self.log_index:
+            self.log_files['index'] = '%s.index' % file_name
+            index_path = os.path.join(self.abs_log_dir,
+                                      self.log_files['index'])
+        if self.log_compression:
+            file_name += COMPRESSION_EXTENSIONS[self.log_compression]
+        self.log_files[key] = file_name
+        log_path = os.path.join(self.abs_log_dir, file_name)
+        if self.log_store:
+            self.derived_logs[log_path] = (self.get_logger_level(log_level),
+                                           self.get_log_formatter(log_format=log_format),
+                                           index_path)
+        else:
+            self.add_file_handler(log_path, log_level=log_level,
+                                  log_format=log_format,
+                                  index_path=index_path)
+
+    def write_derived_logs(self):
+        """With log_store, (re)write the log files from the store."""
+        if not self.log_store or not self.derived_logs:
+            return
+        self.flush()
+        outputs = []
+        for log_path, (levelno, formatter, index_path) in self.derived_logs.items():
+            index = None
+            if index_path:
+                index = LogIndex(index_path)
+            outputs.append((open_compressed(log_path, 'wb'), levelno,
+                            formatter, index))
+        store = open(self.store_path)
+        try:
+            for entry in store:
+                levelno, created, message = entry.rstrip('\n').split(' ', 2)
+                record = make_log_record(self.logger_name, float(created),
+                                         int(levelno), message)
+                for (fh, min_levelno, formatter, index) in outputs:
+                    if record.levelno >= min_levelno:
+                        line = formatter.format(record)
+                        if index is not None:
+                            index.add_lines([record], [line])
+                        fh.write(line + '\n')
+        finally:
+            store.close()
+            for (fh, min_levelno, formatter, index) in outputs:
+                fh.close()
+                if index is not None:
+                    index.close()
 
     def _clear_handlers(self):
         """To prevent dups -- logging will preserve Handlers across
@@ -282,9 +1239,14 @@ class BaseLogger(object):
         if 'all_handlers' in attrs and 'logger' in attrs:
             for handler in self.all_handlers:
                 self.logger.removeHandler(handler)
+                if handler is self.async_handler:
+                    handler.close()
             self.all_handlers = []
+            self.async_handler = None
 
     def __del__(self):
+        self.flush()
+        self.write_derived_logs()
         logging.shutdown()
         self._clear_handlers()
 
@@ -294,34 +1256,88 @@ class BaseLogger(object):
         console_handler.setLevel(self.get_logger_level(log_level))
         console_handler.setFormatter(self.get_log_formatter(log_format=log_format,
                                                             date_format=date_format))
-        self.logger.addHandler(console_handler)
-        self.all_handlers.append(console_handler)
+        self._add_handler(console_handler)
 
     def add_file_handler(self, log_path, log_level=None, log_format=None,
-                       date_format=None):
+                       date_format=None, index_path=None):
         if not self.append_to_log and os.path.exists(log_path):
             os.remove(log_path)
-        file_handler = logging.FileHandler(log_path)
+        if query_compression(log_path):
+            file_handler = CompressedFileHandler(log_path)
+        elif index_path:
+            file_handler = IndexedFileHandler(log_path)
+        else:
+            file_handler = logging.FileHandler(log_path)
+        if index_path:
+            file_handler.index = LogIndex(index_path, log_path=log_path,
+                                          append=self.append_to_log)
         file_handler.setLevel(self.get_logger_level(log_level))
         file_handler.setFormatter(self.get_log_formatter(log_format=log_format,
                                                          date_format=date_format))
-        self.logger.addHandler(file_handler)
-        self.all_handlers.append(file_handler)
+        self._add_handler(file_handler)
+
+    def _add_handler(self, handler):
+        if self.async_handler is not None:
+            self.async_handler.add_target(handler)
+        else:
+            self.logger.addHandler(handler)
+        self.all_handlers.append(handler)
+
+    def flush(self):
+        """Wait until everything logged so far has been written, and
+        leave any compressed logs complete.
+        """
+        if self.async_handler is not None:
+            self.async_handler.flush()
+        for handler in self.all_handlers:
+            if isinstance(handler, CompressedFileHandler):
+                handler.finish_stream()
 
-    def log_message(self, message, level=INFO, exit_code=-1):
+    def query_binary_log(self):
+        """Return the name of the log file in self.abs_log_dir that
+        run_command(binary=True) appends output to by default: the raw
+        log (or the main log, for SimpleFileLogger).
+
+        With log_compression, plain bytes appended to it would corrupt it,
+        and with log_store it's rewritten from the store at the end, so
+        then it's a separate, uncompressed LOGNAME_binary.log instead.
+        """
+        log_file = self.log_files.get('raw') or self.log_files.get('default')
+        if log_file and (self.log_store or self.log_compression):
+            log_file = '%s_binary.log' % self.log_name
+        return log_file
+
+    def log_message(self, message, level=INFO, exit_code=-1,
+                    index_entry=None):
         """Generic log method.
         There should be more options here -- do or don't split by line,
         use os.linesep instead of assuming \n, be able to pass in log level
         by name or number.
 
         Adding the IGNORE special level for runCommand.
+
+        index_entry, if any, goes into the log index for the first line
+        of message; see LogIndex.
         """
         if level == IGNORE:
             return
-        for line in message.splitlines():
-            self.logger.log(self.get_logger_level(level), line)
+        levelno = self.get_logger_level(level)
+        if self.logger.isEnabledFor(levelno):
+            lines = message.splitlines()
+            if self.async_handler is not None:
+                for line in lines:
+                    self.async_handler.add_record(levelno, line, index_entry)
+                    index_entry = None
+            else:
+                if index_entry and lines:
+                    self.logger.log(levelno, lines.pop(0),
+                                    extra={'index_entry': index_entry})
+                for line in lines:
+                    self.logger.log(levelno, line)
         if level == FATAL and self.halt_on_failure:
             self.logger.log(FATAL_LEVEL, 'Exiting %d' % exit_code)
+            self.flush()
+            self.write_derived_logs()
             raise SystemExit(exit_code)
 
 
@@ -341,9 +1357,9 @@ class SimpleFileLogger(BaseLogger):
 
     def new_logger(self, logger_name):
         BaseLogger.new_logger(self, logger_name)
-        self.log_path = os.path.join(self.abs_log_dir, '%s.log' % self.log_name)
-        self.log_files['default'] = self.log_path
-        self.add_file_handler(self.log_path)
+        self.add_log_file('default', '%s.log' % self.log_name, main_log=True)
+        self.log_path = os.path.join(self.abs_log_dir,
+                                     self.log_files['default'])
 
 
 
@@ -369,11 +1385,9 @@ class MultiFileLogger(BaseLogger):
         min_logger_level = self.get_logger_level(self.log_level)
         for level in self.LEVELS.keys():
             if self.get_logger_level(level) >= min_logger_level:
-                self.log_files[level] = '%s_%s.log' % (self.log_name,
-                                                       level)
-                self.add_file_handler(os.path.join(self.abs_log_dir,
-                                                   self.log_files[level]),
-                                      log_level=level)
+                self.add_log_file(level, '%s_%s.log' % (self.log_name, level),
+                                  log_level=level,
+                                  main_log=level == self.log_level)
 
 
 
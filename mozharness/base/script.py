@@ -11,16 +11,21 @@ mozharness.
 """
 
 import codecs
+from collections import deque
+import errno
+import mmap
 import os
-import platform
 import pprint
 import re
+import Queue
 import shutil
+import signal
 import subprocess
 import sys
+import threading
 import time
-import urllib2
-import urlparse
+# urllib2, urlparse, platform, tempfile, multiprocessing and cProfile are
+# imported where they're used, to keep script startup fast.
 if os.name == 'nt':
     try:
         import win32file
@@ -37,7 +42,141 @@ except ImportError:
 
 from mozharness.base.config import BaseConfig
 from mozharness.base.log import SimpleFileLogger, MultiFileLogger, \
-    LogMixin, OutputParser, DEBUG, INFO, ERROR, FATAL
+    LogMixin, OutputParser, CaptureParser, TraceParser, SummaryStore, \
+    COMPRESSION_EXTENSIONS, open_compressed, query_compression, DEBUG, INFO, ERROR, \
+    FATAL
+
+# What run_command() returns for a command killed by its output_timeout or
+# max_run_time, so retry() etc. can tell a hang from a failure.
+TIMEOUT_STATUS = -1000
+
+
+# Process groups {{{1
+# Commands that need killing along with their children (see
+# ScriptMixin._kill_process_tree()) are started in a process group of
+# their own.  That also keeps signals sent to ours, like a buildbot
+# timeout or ^C, from reaching them, so while they run, _forward_signal()
+# passes those on.
+FORWARDED_SIGNALS = [getattr(signal, name) for name in
+                     ('SIGTERM', 'SIGINT', 'SIGHUP') if hasattr(signal, name)]
+_process_groups = set()
+_previous_signal_handlers = {}
+# Run as "python -c PROCESS_GROUP_WRAPPER command args...": move into a
+# process group of our own, then exec the command.  Popen(preexec_fn=
+# os.setpgrp) would do the same in the forked child, but running Python
+# code there can deadlock in Python 2 while other threads (output
+# collectors, watchdogs) hold locks.
+PROCESS_GROUP_WRAPPER = """import os, sys
+os.setpgrp()
+try:
+    os.execvp(sys.argv[1], sys.argv[1:])
+except OSError, e:
+    sys.stderr.write('%s: %s\\n' % (sys.argv[1], e.strerror))
+    sys.exit(127)
+"""
+
+
+def _forward_signal(signum, frame):
+    """Signal handler: send signum on to the commands in _process_groups,
+    then do what the previous handler would have.
+    """
+    for p in list(_process_groups):
+        try:
+            if os.name == 'nt':
+                subprocess.call(['taskkill', '/F', '/T', '/PID', str(p.pid)])
+            else:
+                os.killpg(p.pid, signum)
+        except OSError:
+            pass
+    previous = _previous_signal_handlers.get(signum, signal.SIG_DFL)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def _install_signal_forwarding():
+    """Install _forward_signal() for FORWARDED_SIGNALS, if it isn't yet.
+    Returns False if we can't: only the main thread can set handlers.
+    """
+    if _previous_signal_handlers:
+        return True
+    if threading.current_thread().name != 'MainThread':
+        return False
+    for signum in FORWARDED_SIGNALS:
+        previous = signal.getsignal(signum)
+        if previous in (signal.SIG_IGN, None):
+            # Ignored (e.g. SIGHUP under nohup), or not a Python handler.
+            continue
+        _previous_signal_handlers[signum] = previous
+        signal.signal(signum, _forward_signal)
+    return True
+
+
+# OutputCollector {{{1
+class OutputCollector(threading.Thread):
+    """Read a command's output from a pipe in the background.
+
+    By default we keep all of it.  With head_lines and/or tail_lines, we
+    only keep the first and/or last N lines; iter_lines, e.g.
+    ScriptMixin._iter_output_lines, splits the output into lines.
+    self.num_bytes is how much we've read so far.
+
+    pipe can be None to just use add_lines() and query_output().
+    """
+    def __init__(self, pipe, iter_lines=None, head_lines=None,
+                 tail_lines=None, chunk_size=64 * 1024):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pipe = pipe
+        self.iter_lines = iter_lines
+        self.head_lines = head_lines
+        self.tail_lines = tail_lines
+        self.chunk_size = chunk_size
+        self.num_bytes = 0
+        self.chunks = []
+        self.head = []
+        self.tail = None
+        if tail_lines is not None:
+            self.tail = deque(maxlen=tail_lines)
+
+    def query_limited(self):
+        return self.head_lines is not None or self.tail_lines is not None
+
+    def read(self, size):
+        try:
+            chunk = os.read(self.pipe.fileno(), size)
+        except (OSError, ValueError):
+            # The pipe was closed under us, e.g. by get_output_from_command
+            # giving up on a command that timed out.
+            return ''
+        self.num_bytes += len(chunk)
+        return chunk
+
+    def run(self):
+        if self.query_limited():
+            for lines in self.iter_lines(self.read):
+                self.add_lines(lines)
+        else:
+            while True:
+                chunk = self.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.chunks.append(chunk)
+
+    def add_lines(self, lines):
+        if self.head_lines is not None and len(self.head) < self.head_lines:
+            num_lines = self.head_lines - len(self.head)
+            self.head.extend(lines[:num_lines])
+            lines = lines[num_lines:]
+        if self.tail is not None:
+            self.tail.extend(lines)
+
+    def query_output(self):
+        if self.query_limited():
+            return '\n'.join(self.head + list(self.tail or []))
+        return ''.join(self.chunks)
 
 
 # ScriptMixin {{{1
@@ -52,6 +191,8 @@ class ScriptMixin(object):
     """
 
     env = None
+    # How much command output to read at a time.
+    output_chunk_size = 64 * 1024
 
     # Simple filesystem commands {{{2
     def mkdir_p(self, path, error_level=ERROR):
@@ -67,7 +208,7 @@ class ScriptMixin(object):
                          level=error_level)
                 return -1
         else:
-            self.debug("mkdir_p: %s Already exists." % path)
+            self.debug("mkdir_p: %s Already exists.", path)
 
     def rmtree(self, path, log_level=INFO, error_level=ERROR,
                exit_code=-1):
@@ -106,6 +247,7 @@ class ScriptMixin(object):
             self.debug("%s doesn't exist." % path)
 
     def _is_windows(self):
+        import platform
         system = platform.system()
         if system in ("Windows", "Microsoft"):
             return True
@@ -160,6 +302,7 @@ class ScriptMixin(object):
         win32file.RemoveDirectory('\\\\?\\' + path)
 
     def get_filename_from_url(self, url):
+        import urlparse
         parsed = urlparse.urlsplit(url.rstrip('/'))
         if parsed.path != '':
             return parsed.path.rsplit('/', 1)[-1]
@@ -169,6 +312,8 @@ class ScriptMixin(object):
     def _download_file(self, url, file_name):
         """ Helper script for download_file()
             """
+        import urllib2
+        import urlparse
         try:
             f = urllib2.urlopen(url)
             local_file = open(file_name, 'wb')
@@ -203,6 +348,7 @@ class ScriptMixin(object):
                       exit_code=-1):
         """Python wget.
         """
+        import urllib2
         if not file_name:
             try:
                 file_name = self.get_filename_from_url(url)
@@ -241,10 +387,23 @@ class ScriptMixin(object):
         self.info("Chmoding %s to %s" % (path, str(oct(mode))))
         os.chmod(path, mode)
 
-    def copyfile(self, src, dest, log_level=INFO, error_level=ERROR, copystat=False):
+    def copyfile(self, src, dest, log_level=INFO, error_level=ERROR, copystat=False,
+                 compress=False):
+        """Copy src to dest.  With compress, compress src on the way,
+        with gzip or zstd according to dest's extension (.gz or .zst).
+        """
         self.log("Copying %s to %s" % (src, dest), level=log_level)
         try:
-            shutil.copyfile(src, dest)
+            if compress:
+                src_fh = open(src, 'rb')
+                dest_fh = open_compressed(dest, 'wb')
+                try:
+                    shutil.copyfileobj(src_fh, dest_fh, 1024 * 1024)
+                finally:
+                    dest_fh.close()
+                    src_fh.close()
+            else:
+                shutil.copyfile(src, dest)
             if copystat:
                 shutil.copystat(src, dest)
         except (IOError, shutil.Error), e:
@@ -286,10 +445,10 @@ class ScriptMixin(object):
                                           overwrite='no_overwrite')
                         else:
                             self.debug('ignoring path: %s as destination: \
-                                    %s exists' % (abs_src_f, abs_dest_f))
+                                    %s exists', abs_src_f, abs_dest_f)
                     else:  # overwrite == 'overwrite_if_exists' and destination exists
-                        self.debug('overwriting: %s with: %s' %
-                                   (abs_dest_f, abs_src_f))
+                        self.debug('overwriting: %s with: %s',
+                                   abs_dest_f, abs_src_f)
                         self.rmtree(abs_dest_f)
 
                         if os.path.isdir(abs_src_f):
@@ -422,15 +581,15 @@ class ScriptMixin(object):
         if not attempts:
             attempts = self.config.get("global_retries", 5)
         if max_sleeptime < sleeptime:
-            self.debug("max_sleeptime %d less than sleeptime %d" % (
-                       max_sleeptime, sleeptime))
+            self.debug("max_sleeptime %d less than sleeptime %d",
+                       max_sleeptime, sleeptime)
         n = 0
         while n <= attempts:
             retry = False
             n += 1
             try:
-                self.info("retry: Calling %s with args: %s, kwargs: %s, attempt #%d" %
-                          (action, str(args), str(kwargs), n))
+                self.info("retry: Calling %s with args: %s, kwargs: %s, attempt #%d",
+                          action, args, kwargs, n)
                 status = action(*args, **kwargs)
                 if good_statuses and status not in good_statuses:
                     retry = True
@@ -447,7 +606,7 @@ class ScriptMixin(object):
                     self.log(error_message, level=error_level)
                     return failure_status
                 if sleeptime > 0:
-                    self.info("retry: Failed, sleeping %d seconds before retrying" %
+                    self.info("retry: Failed, sleeping %d seconds before retrying",
                               sleeptime)
                     time.sleep(sleeptime)
                     sleeptime = sleeptime * 2
@@ -485,7 +644,8 @@ class ScriptMixin(object):
                     replace_dict[key] = default_replace_dict[key]
         for key in partial_env.keys():
             env[key] = partial_env[key] % replace_dict
-            self.log("ENV: %s is now %s" % (key, env[key]), level=log_level)
+            self.log("ENV: %s is now %s", level=log_level,
+                     args=(key, env[key]))
         if set_self_env:
             self.env = env
         return env
@@ -532,27 +692,69 @@ class ScriptMixin(object):
     def run_command(self, command, cwd=None, error_list=None, parse_at_end=False,
                     halt_on_failure=False, success_codes=None,
                     env=None, return_type='status', throw_exception=False,
-                    output_parser=None):
+                    output_parser=None, capture_list=None,
+                    abort_grace_period=None, output_timeout=None,
+                    max_run_time=None, binary=False, output_file=None):
         """Run a command, with logging and error parsing.
 
-        TODO: parse_at_end, context_lines
         TODO: retry_interval?
         TODO: error_level_override?
         TODO: Add a copy-pastable version of |command| if it's a list.
         TODO: print env if set
 
         output_parser lets you provide an instance of your own OutputParser
-        subclass, or pass None to use OutputParser.
+        subclass, or pass None to use OutputParser.  It can also be a list
+        of independent parsers, which are all fed from the same read loop;
+        each keeps its own state (num_errors, evaluate_parser(), etc.).
+        Usually only the first one logs the output, and the rest are
+        created with log_output=False.  With a list, return_type
+        'num_errors' and halt_on_failure go by the errors in all of them.
+
+        capture_list is a list of named regexes to pick values out of the
+        output as it streams by; see CaptureParser for the format.  With a
+        capture_list, run_command returns a (return value, captures) tuple,
+        where captures maps each name to its value(s), or None if it never
+        matched.
+
+        If an error_list entry is marked 'abort': True, a matching line
+        gets the command and any children it started killed, rather than
+        waiting for it to exit.  To catch any output explaining the error,
+        the kill waits abort_grace_period seconds (default:
+        self.config['abort_grace_period'], or 10) or until the command
+        exits, whichever comes first.  This doesn't apply to parse_at_end.
+
+        output_timeout and max_run_time, in seconds, kill the command and
+        any children it started if it goes that long without any output,
+        or runs that long in total.  The command then returns
+        TIMEOUT_STATUS, or counts as one more error for return_type
+        'num_errors'.
+
+        parse_at_end spools the output to a temporary file while the command
+        runs, so a slow parser never holds up the child on a full pipe, then
+        parses it all once the command exits.  The log ends up the same,
+        just not in real time.
+
+        binary=True is for big output nobody needs to read line by line,
+        like tar listings: the command writes it straight to output_file,
+        a path or an open file, or by default the raw log (or the main
+        log, with SimpleFileLogger; or LOGNAME_binary.log with
+        --log-compression or --log-store, see
+        BaseLogger.query_binary_log()).  Nothing is parsed or logged but the
+        number of bytes written; error_list, output_parser, capture_list
+        and parse_at_end don't apply.
 
         error_list example:
         [{'regex': re.compile('^Error: LOL J/K'), level=IGNORE},
-         {'regex': re.compile('^Error:'), level=ERROR, contextLines='5:5'},
-         {'substr': 'THE WORLD IS ENDING', level=FATAL, contextLines='20:'}
+         {'regex': re.compile('^Error:'), level=ERROR, context_lines='5:5'},
+         {'substr': 'THE WORLD IS ENDING', level=FATAL, context_lines='20:'}
         ]
-        (context_lines isn't written yet)
         """
         if success_codes is None:
             success_codes = [0]
+        capture_parser = None
+        if capture_list is not None:
+            capture_parser = CaptureParser(capture_list, config=self.config,
+                                           log_obj=self.log_obj)
         if cwd is not None:
             if not os.path.isdir(cwd):
                 level = ERROR
@@ -560,60 +762,518 @@ class ScriptMixin(object):
                     level = FATAL
                 self.log("Can't run command %s in non-existent directory '%s'!" %
                          (command, cwd), level=level)
-                return -1
-            self.info("Running command: %s in %s" % (command, cwd))
+                return self._query_command_result(-1, capture_parser)
+            self.log("Running command: %s in %s", args=(command, cwd),
+                     index_entry={'command': command, 'cwd': cwd})
         else:
-            self.info("Running command: %s" % command)
+            self.log("Running command: %s", args=(command,),
+                     index_entry={'command': command})
         if isinstance(command, list):
-            self.info("Copy/paste: %s" % subprocess.list2cmdline(command))
+            self.info(lambda: "Copy/paste: %s" % subprocess.list2cmdline(command))
         shell = True
         if isinstance(command, list):
             shell = False
+        if binary:
+            parsers = []
+        elif output_parser is None:
+            parsers = [OutputParser(config=self.config, log_obj=self.log_obj,
+                                    error_list=error_list)]
+        elif isinstance(output_parser, (list, tuple)):
+            parsers = list(output_parser)
+        else:
+            parsers = [output_parser]
+        if capture_parser is not None and not binary:
+            parsers.append(capture_parser)
+        summary_store = getattr(self, 'summary_store', None)
+        for parser in parsers:
+            if getattr(parser, 'summary_store', None) is None:
+                parser.summary_store = summary_store
+        trace_parser = None
+        if not (binary or parse_at_end):
+            trace_parser = self._query_trace_parser()
+            if trace_parser is not None:
+                parsers.append(trace_parser)
+        watch_output = False
+        if not (binary or parse_at_end):
+            watch_output = bool(output_timeout or max_run_time)
+            for parser in parsers:
+                if parser.query_matcher().has_abort:
+                    watch_output = True
+        stdout = subprocess.PIPE
+        start_time = time.time()
         try:
-            p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
-                                 cwd=cwd, stderr=subprocess.STDOUT, env=env)
-        except OSError, e:
+            if binary:
+                stdout = self._open_binary_output(output_file)
+                start_size = os.fstat(stdout.fileno()).st_size
+            elif parse_at_end:
+                import tempfile
+                stdout = tempfile.TemporaryFile(prefix='mozharness_spool')
+            p = self._start_process(
+                command, shell,
+                process_group=bool(watch_output or output_timeout or max_run_time),
+                stdout=stdout, cwd=cwd, stderr=subprocess.STDOUT, env=env)
+        except (OSError, IOError), e:
+            if stdout not in (subprocess.PIPE, output_file):
+                stdout.close()
             level = ERROR
             if halt_on_failure:
                 level = FATAL
             self.log('caught OS error %s: %s while running %s' % (e.errno,
                      e.strerror, command), level=level)
-            return -1
-        if output_parser is None:
-            parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                                  error_list=error_list)
+            return self._query_command_result(-1, capture_parser)
+        timed_out = None
+        if binary:
+            query_size = lambda: os.fstat(stdout.fileno()).st_size - start_size
+            timed_out = self._wait_for_process(p, query_size,
+                                               output_timeout=output_timeout,
+                                               max_run_time=max_run_time)
+            self.info("Wrote %d bytes of output to %s." %
+                      (query_size(), getattr(stdout, 'name', stdout)))
+            if stdout is not output_file:
+                stdout.close()
+        elif parse_at_end:
+            timed_out = self._wait_for_process(p, lambda: os.fstat(stdout.fileno()).st_size,
+                                               output_timeout=output_timeout,
+                                               max_run_time=max_run_time)
+            self._parse_spooled_output(stdout, parsers)
+        elif watch_output:
+            if abort_grace_period is None:
+                abort_grace_period = self.config.get('abort_grace_period', 10)
+            timed_out = self._watch_output(p, parsers, abort_grace_period,
+                                           output_timeout=output_timeout,
+                                           max_run_time=max_run_time)
+            self._poll_process(p, block=True)
         else:
-            parser = output_parser
-        loop = True
-        while loop:
-            if p.poll() is not None:
-                """Avoid losing the final lines of the log?"""
-                loop = False
-            while True:
-                line = p.stdout.readline()
-                if not line:
-                    break
-                parser.add_lines(line)
+            fd = p.stdout.fileno()
+            for lines in self._iter_output_lines(lambda size: os.read(fd, size)):
+                self._add_output_lines(parsers, lines)
+            self._poll_process(p, block=True)
+        _process_groups.discard(p)
+        self._record_command_usage(command, cwd, p, start_time)
+        self._add_command_trace(command, cwd, p, start_time, trace_parser)
+        num_errors = 0
+        for parser in parsers:
+            parser.finish()
+            num_errors += parser.num_errors
+        if timed_out:
+            num_errors += 1
         return_level = INFO
         if p.returncode not in success_codes:
             return_level = ERROR
             if throw_exception:
                 raise subprocess.CalledProcessError(p.returncode, command)
-        self.log("Return code: %d" % p.returncode, level=return_level)
+        self.log("Return code: %d" % p.returncode, level=return_level,
+                 index_entry={'return_code': p.returncode})
         if halt_on_failure:
-            if parser.num_errors or p.returncode not in success_codes:
+            if num_errors or p.returncode not in success_codes:
                 self.fatal("Halting on failure while running %s" % command,
                            exit_code=p.returncode)
         if return_type == 'num_errors':
-            return parser.num_errors
+            return self._query_command_result(num_errors, capture_parser)
+        if timed_out:
+            return self._query_command_result(TIMEOUT_STATUS, capture_parser)
+        return self._query_command_result(p.returncode, capture_parser)
+
+    def _open_binary_output(self, output_file):
+        """Return the file run_command(binary=True) should send output
+        to: output_file if it's already open, output_file opened for
+        appending, or by default the log file from
+        BaseLogger.query_binary_log().
+        """
+        if hasattr(self.log_obj, 'flush'):
+            # Anything logged so far (e.g. queued by --async-log) should
+            # come first.
+            self.log_obj.flush()
+        if output_file is None:
+            log_file = None
+            if hasattr(self.log_obj, 'query_binary_log'):
+                log_file = self.log_obj.query_binary_log()
+            if log_file:
+                output_file = os.path.join(self.log_obj.abs_log_dir, log_file)
+            else:
+                output_file = os.devnull
+        if hasattr(output_file, 'write'):
+            # Anything we've written ourselves should come first.
+            output_file.flush()
+            return output_file
+        return open(output_file, 'ab')
+
+    def _query_command_result(self, result, capture_parser):
+        """Add the captures to run_command's return value, if there's a
+        capture_list.
+        """
+        if capture_parser is None:
+            return result
+        return (result, capture_parser.captures)
+
+    def _add_output_lines(self, parsers, lines):
+        """Feed a list of lines to each parser in parsers.  With more
+        than one parser, the lines are stripped once up front.
+        """
+        if len(parsers) == 1:
+            parsers[0].add_lines(lines)
+            return
+        lines = [line.rstrip() for line in lines]
+        for parser in parsers:
+            parser.add_lines(lines)
+
+    def _parse_spooled_output(self, spool, parsers):
+        """Feed the contents of spool, an open file, into parsers line by
+        line, then close it.  Used by run_command(parse_at_end=True).
+        """
+        try:
+            spool.seek(0, os.SEEK_END)
+            if not spool.tell():
+                return
+            buf = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for lines in self._iter_output_lines(buf.read):
+                    self._add_output_lines(parsers, lines)
+            finally:
+                buf.close()
+        finally:
+            spool.close()
+
+    def _watch_output(self, p, parsers, abort_grace_period,
+                      output_timeout=None, max_run_time=None):
+        """Feed p's output into parsers from a reader thread, so we can
+        act while the command is quiet.  Kill the process tree once a
+        parser has matched an 'abort' error_list entry, or on
+        output_timeout or max_run_time; in the latter case, return a
+        description of the timeout.
+        p needs to have been started in a new process group.
+        """
+        fd = p.stdout.fileno()
+        # Bounded, so a slow parser still holds up the command.
+        output = Queue.Queue(maxsize=64)
+
+        def read_output():
+            try:
+                for lines in self._iter_output_lines(lambda size: os.read(fd, size)):
+                    output.put(lines)
+            finally:
+                output.put(None)
+        reader = threading.Thread(target=read_output)
+        reader.daemon = True
+        reader.start()
+        start_time = last_output_time = time.time()
+        abort_time = None
+        timed_out = None
+        killed = False
+        try:
+            while True:
+                try:
+                    lines = output.get(timeout=1)
+                except Queue.Empty:
+                    if killed and self._poll_process(p) is not None:
+                        # Something outside the process group still
+                        # holds the pipe open; stop waiting for it.
+                        break
+                    lines = []
+                if lines is None:
+                    break
+                now = time.time()
+                if lines:
+                    last_output_time = now
+                    self._add_output_lines(parsers, lines)
+                if killed:
+                    continue
+                if abort_time is None:
+                    for parser in parsers:
+                        if parser.abort_error_check is not None:
+                            self.error("Aborting in %d seconds: '%s' matched %s" %
+                                       (abort_grace_period,
+                                        self._query_error_check_pattern(parser.abort_error_check),
+                                        parser.abort_line.decode('utf-8', 'replace')))
+                            abort_time = now + abort_grace_period
+                            break
+                timed_out = self._query_timeout(now, start_time,
+                                                last_output_time,
+                                                output_timeout, max_run_time)
+                if timed_out:
+                    self.error("Timed out: %s!  Killing process group %d." %
+                               (timed_out, p.pid))
+                elif abort_time is not None and now >= abort_time:
+                    if self._poll_process(p) is None:
+                        self.error("Killing process group %d." % p.pid)
+                else:
+                    continue
+                self._kill_process_tree(p)
+                killed = True
+        except:
+            # e.g. SystemExit from a FATAL line; don't leave the command
+            # running.
+            self._kill_process_tree(p)
+            raise
+        return timed_out
+
+    def _wait_for_process(self, p, query_output_size, output_timeout=None,
+                          max_run_time=None, progress_interval=None):
+        """Wait for p to exit, like p.wait(), while keeping an eye on how
+        much output it has written, per query_output_size().  On
+        output_timeout or max_run_time, kill p's process tree and return
+        a description of the timeout.  Log how it's doing every progress_interval seconds.
+        p needs to have been started in a new process group for the
+        timeouts.
+        """
+        if not (output_timeout or max_run_time or progress_interval):
+            self._poll_process(p, block=True)
+            return None
+        start_time = last_output_time = last_progress_time = time.time()
+        output_size = 0
+        interval = 0.01
+        while self._poll_process(p) is None:
+            time.sleep(interval)
+            # Short commands shouldn't have to wait for a whole second.
+            interval = min(interval * 2, 1)
+            now = time.time()
+            size = query_output_size()
+            if size != output_size:
+                output_size = size
+                last_output_time = now
+            timed_out = self._query_timeout(now, start_time, last_output_time,
+                                            output_timeout, max_run_time)
+            if timed_out:
+                self.error("Timed out: %s!  Killing process group %d." %
+                           (timed_out, p.pid))
+                self._kill_process_tree(p)
+                self._poll_process(p, block=True)
+                return timed_out
+            if progress_interval and now - last_progress_time >= progress_interval:
+                self.info("Still waiting for process %d after %d seconds; %d bytes of output so far." %
+                          (p.pid, now - start_time, output_size))
+                last_progress_time = now
+        return None
+
+    def _query_timeout(self, now, start_time, last_output_time,
+                       output_timeout, max_run_time):
+        if output_timeout and now - last_output_time >= output_timeout:
+            return "no output for %d seconds" % output_timeout
+        if max_run_time and now - start_time >= max_run_time:
+            return "still running after %d seconds" % max_run_time
+        return None
+
+    def _poll_process(self, p, block=False):
+        """p.poll(), or p.wait() if block, but reaping p with os.wait4()
+        where we have it, to keep its resource usage in p.rusage.
+        """
+        if p.returncode is not None or not hasattr(os, 'wait4'):
+            if block:
+                return p.wait()
+            return p.poll()
+        flags = os.WNOHANG
+        if block:
+            flags = 0
+        while True:
+            try:
+                (pid, status, rusage) = os.wait4(p.pid, flags)
+                break
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    # Someone else reaped it.
+                    if block:
+                        return p.wait()
+                    return p.poll()
+                raise
+        if not pid:
+            return None
+        p.rusage = rusage
+        # Set p.returncode the same way p.wait() would, so p.wait() and
+        # p.poll() just return it.
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
         return p.returncode
 
+    def _record_command_usage(self, command, cwd, p, start_time):
+        """Add how long p took and the resources it and its children
+        used to self.command_usage, if we're keeping track; see
+        BaseScript.dump_command_usage().
+        """
+        command_usage = getattr(self, 'command_usage', None)
+        if command_usage is None:
+            return
+        if isinstance(command, list):
+            command = subprocess.list2cmdline(command)
+        usage = {
+            'command': command,
+            'cwd': cwd,
+            'action': getattr(self, 'current_action', None),
+            'return_code': p.returncode,
+            'wall_time': round(time.time() - start_time, 3),
+            'user_time': None,
+            'sys_time': None,
+            'max_rss_kb': None,
+            'read_bytes': None,
+            'write_bytes': None,
+        }
+        rusage = getattr(p, 'rusage', None)
+        if rusage is not None:
+            usage['user_time'] = round(rusage.ru_utime, 3)
+            usage['sys_time'] = round(rusage.ru_stime, 3)
+            usage['max_rss_kb'] = rusage.ru_maxrss
+            if os.path.exists('/proc/self/io'):
+                # Linux counts the storage I/O in /proc/PID/io's
+                # read_bytes and write_bytes in these, in 512 byte units,
+                # children included.  /proc/PID/io itself is gone once
+                # we've reaped the process.
+                usage['read_bytes'] = rusage.ru_inblock * 512
+                usage['write_bytes'] = rusage.ru_oublock * 512
+        command_usage.append(usage)
+        self.debug("%s took %.1fs; user %ss, sys %ss, max rss %s KB.",
+                   command, usage['wall_time'], usage['user_time'],
+                   usage['sys_time'], usage['max_rss_kb'])
+
+    def _query_trace_parser(self):
+        """A TraceParser for config['trace_phase_markers'], if we're
+        tracing and there are any; see BaseScript.dump_trace().
+        """
+        if getattr(self, 'trace_events', None) is None:
+            return None
+        phase_markers = self.config.get('trace_phase_markers')
+        if not phase_markers:
+            return None
+        return TraceParser(phase_markers, config=self.config,
+                           log_obj=self.log_obj)
+
+    def _add_trace_event(self, name, category, start_time, end_time=None,
+                         args=None):
+        """Add a complete event to self.trace_events, in Chrome's trace
+        event format, if we're tracing.
+        """
+        trace_events = getattr(self, 'trace_events', None)
+        if trace_events is None:
+            return
+        if end_time is None:
+            end_time = time.time()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start_time * 1000000),
+            'dur': int((end_time - start_time) * 1000000),
+            'pid': os.getpid(),
+            # Commands run from other threads get a row each.
+            'tid': threading.current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        trace_events.append(event)
+
+    def _add_command_trace(self, command, cwd, p, start_time,
+                           trace_parser=None):
+        """Add p, and the phases trace_parser marked in its output, to
+        self.trace_events.  Each phase runs from its marker line to the
+        next one, or to the end of the command.
+        """
+        if getattr(self, 'trace_events', None) is None:
+            return
+        end_time = time.time()
+        if isinstance(command, list):
+            command = subprocess.list2cmdline(command)
+        self._add_trace_event(command[:100], 'command', start_time,
+                              end_time=end_time,
+                              args={'command': command, 'cwd': cwd,
+                                    'return_code': p.returncode})
+        if trace_parser is None:
+            return
+        marks = trace_parser.marks
+        for i, (mark_time, line) in enumerate(marks):
+            if i + 1 < len(marks):
+                phase_end_time = marks[i + 1][0]
+            else:
+                phase_end_time = end_time
+            line = line.decode('utf-8', 'replace')
+            self._add_trace_event(line[:100], 'phase', mark_time,
+                                  end_time=phase_end_time,
+                                  args={'line': line})
+
+    def _start_process(self, command, shell, process_group=False, **kwargs):
+        """subprocess.Popen(command, shell=shell, **kwargs).
+
+        With process_group, the command gets a process group of its own,
+        so _kill_process_tree() can kill it and its children.  That takes
+        an extra python process on the way in (see PROCESS_GROUP_WRAPPER),
+        and a command that can't be run exits 127 instead of raising
+        OSError.  Signals that end us have to reach the group too, so if
+        we can't forward them (see _forward_signal()), the command stays
+        in ours.
+        """
+        process_group = process_group and _install_signal_forwarding()
+        if process_group:
+            if os.name == 'nt':
+                kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                if shell:
+                    command = ['/bin/sh', '-c', command]
+                command = [sys.executable, '-E', '-S', '-c',
+                           PROCESS_GROUP_WRAPPER] + list(command)
+                shell = False
+        p = subprocess.Popen(command, shell=shell, **kwargs)
+        if process_group:
+            _process_groups.add(p)
+        return p
+
+    def _query_error_check_pattern(self, error_check):
+        if 'substr' in error_check:
+            return error_check['substr']
+        return error_check['regex'].pattern
+
+    def _kill_process_tree(self, p, timeout=5):
+        """Terminate p and everything in its process group, then kill
+        whatever is still around after timeout seconds.
+        If p wasn't started in a new process group (see _start_process()),
+        only p itself is killed.
+        """
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(p.pid)])
+            return
+        kill = os.killpg
+        if p not in _process_groups:
+            kill = os.kill
+        try:
+            kill(p.pid, signal.SIGTERM)
+        except OSError:
+            # Nothing left in the group.
+            return
+        end_time = time.time() + timeout
+        while self._poll_process(p) is None and time.time() < end_time:
+            time.sleep(0.1)
+        try:
+            kill(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _iter_output_lines(self, read):
+        """Yield lists of lines from read(size), e.g. os.read on a pipe,
+        which returns '' at EOF.  Reading in large chunks and splitting
+        them ourselves is a lot cheaper than a readline() per line.
+        The newlines are stripped; a final unterminated line is kept.
+        """
+        remainder = ''
+        while True:
+            chunk = read(self.output_chunk_size)
+            if not chunk:
+                break
+            lines = chunk.split('\n')
+            lines[0] = remainder + lines[0]
+            remainder = lines.pop()
+            if lines:
+                yield lines
+        if remainder:
+            yield [remainder]
+
     def get_output_from_command(self, command, cwd=None,
                                 halt_on_failure=False, env=None,
                                 silent=False, log_level=INFO,
                                 tmpfile_base_path='tmpfile',
                                 return_type='output', save_tmpfiles=False,
-                                throw_exception=False):
+                                throw_exception=False, output_timeout=None,
+                                max_run_time=None, progress_interval=None,
+                                head_lines=None, tail_lines=None):
         """Similar to run_command, but where run_command is an
         os.system(command) analog, get_output_from_command is a `command`
         analog.
@@ -621,10 +1281,23 @@ class ScriptMixin(object):
         Less error checking by design, though if we figure out how to
         do it without borking the output, great.
 
+        stdout and stderr are read from pipes into memory, unless
+        save_tmpfiles is set or return_type isn't 'output'; then they're
+        written to tmpfile_base_path + '_stdout' and '_stderr'.
+
+        head_lines and/or tail_lines only keep the first and/or last N
+        lines of output, so a chatty command doesn't fill up memory or
+        the log.  For output you want to process as it comes, see
+        iter_output_from_command().
+
+        output_timeout and max_run_time work as in run_command; a command
+        that times out returns TIMEOUT_STATUS, whatever the return_type,
+        so it can be told apart from one with no output (None).  With
+        throw_exception it raises CalledProcessError, with returncode
+        TIMEOUT_STATUS, so retry() can retry it.  progress_interval logs
+        that we're still waiting every N seconds.
+
         TODO: binary mode? silent is kinda like that.
-        TODO: since p.wait() can take a long time, optionally log something
-        every N seconds?
-        TODO: optionally only keep the first or last (N) line(s) of output?
         TODO: optionally only return the tmp_stdout_filename?
         """
         if cwd:
@@ -635,52 +1308,105 @@ class ScriptMixin(object):
                 self.log("Can't run command %s in non-existent directory %s!" %
                          (command, cwd), level=level)
                 return None
-            self.info("Getting output from command: %s in %s" % (command, cwd))
+            self.info("Getting output from command: %s in %s", command, cwd)
         else:
-            self.info("Getting output from command: %s" % command)
+            self.info("Getting output from command: %s", command)
         if isinstance(command, list):
-            self.info("Copy/paste: %s" % subprocess.list2cmdline(command))
-        # This could potentially return something?
-        tmp_stdout = None
-        tmp_stderr = None
+            self.info(lambda: "Copy/paste: %s" % subprocess.list2cmdline(command))
+        use_tmpfiles = save_tmpfiles or return_type != 'output'
+        tmp_stdout = subprocess.PIPE
+        tmp_stderr = subprocess.PIPE
         tmp_stdout_filename = '%s_stdout' % tmpfile_base_path
         tmp_stderr_filename = '%s_stderr' % tmpfile_base_path
-
-        # TODO probably some more elegant solution than 2 similar passes
-        try:
-            tmp_stdout = open(tmp_stdout_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stdout_filename +
-                     self.exception(), level=level)
-            return None
-        try:
-            tmp_stderr = open(tmp_stderr_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stderr_filename +
-                     self.exception(), level=level)
-            return None
+        if use_tmpfiles:
+            # TODO probably some more elegant solution than 2 similar passes
+            try:
+                tmp_stdout = open(tmp_stdout_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stdout_filename +
+                         self.exception(), level=level)
+                return None
+            try:
+                tmp_stderr = open(tmp_stderr_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stderr_filename +
+                         self.exception(), level=level)
+                return None
         shell = True
         if isinstance(command, list):
             shell = False
-        p = subprocess.Popen(command, shell=shell, stdout=tmp_stdout,
-                             cwd=cwd, stderr=tmp_stderr, env=env)
-        #XXX: changed from self.debug to self.log due to this error:
-        #     TypeError: debug() takes exactly 1 argument (2 given)
-        self.log("Temporary files: %s and %s" % (tmp_stdout_filename, tmp_stderr_filename), level=DEBUG)
-        p.wait()
-        tmp_stdout.close()
-        tmp_stderr.close()
+        start_time = time.time()
+        p = self._start_process(command, shell,
+                                process_group=bool(output_timeout or max_run_time),
+                                stdout=tmp_stdout, cwd=cwd, stderr=tmp_stderr,
+                                env=env)
+        if use_tmpfiles:
+            self.debug("Temporary files: %s and %s", tmp_stdout_filename,
+                       tmp_stderr_filename)
+            timed_out = self._wait_for_process(
+                p, lambda: (os.fstat(tmp_stdout.fileno()).st_size +
+                            os.fstat(tmp_stderr.fileno()).st_size),
+                output_timeout=output_timeout, max_run_time=max_run_time,
+                progress_interval=progress_interval)
+            tmp_stdout.close()
+            tmp_stderr.close()
+            output = None
+            if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
+                output = self.read_from_file(tmp_stdout_filename,
+                                             verbose=False)
+                if head_lines is not None or tail_lines is not None:
+                    collector = OutputCollector(None, head_lines=head_lines,
+                                                tail_lines=tail_lines)
+                    collector.add_lines(output.splitlines())
+                    output = collector.query_output()
+            errors = None
+            if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
+                errors = self.read_from_file(tmp_stderr_filename,
+                                             verbose=False)
+        else:
+            # Drain both pipes at once, so the command can't block on
+            # a full one.
+            stdout_collector = OutputCollector(p.stdout,
+                                               iter_lines=self._iter_output_lines,
+                                               head_lines=head_lines,
+                                               tail_lines=tail_lines)
+            stderr_collector = OutputCollector(p.stderr)
+            stdout_collector.start()
+            stderr_collector.start()
+            timed_out = self._wait_for_process(
+                p, lambda: stdout_collector.num_bytes + stderr_collector.num_bytes,
+                output_timeout=output_timeout, max_run_time=max_run_time,
+                progress_interval=progress_interval)
+            end_time = None
+            if timed_out:
+                # Something that escaped the kill, like a daemonized
+                # grandchild, can keep the pipes open; don't wait for it.
+                end_time = time.time() + 5
+            for collector in (stdout_collector, stderr_collector):
+                if end_time is None:
+                    collector.join()
+                else:
+                    collector.join(max(0, end_time - time.time()))
+            if stdout_collector.is_alive() or stderr_collector.is_alive():
+                self.warning("The output of process %d is still open after killing it; giving up on it." % p.pid)
+            p.stdout.close()
+            p.stderr.close()
+            output = stdout_collector.query_output() or None
+            errors = stderr_collector.query_output() or None
+        _process_groups.discard(p)
+        self._record_command_usage(command, cwd, p, start_time)
+        self._add_command_trace(command, cwd, p, start_time)
+        returncode = p.returncode
+        if timed_out:
+            returncode = TIMEOUT_STATUS
         return_level = DEBUG
-        output = None
-        if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
-            output = self.read_from_file(tmp_stdout_filename,
-                                         verbose=False)
+        if output:
             if not silent:
                 self.log("Output received:", level=log_level)
                 output_lines = output.rstrip().splitlines()
@@ -690,28 +1416,28 @@ class ScriptMixin(object):
                     line = line.decode("utf-8")
                     self.log(' %s' % line, level=log_level)
                 output = '\n'.join(output_lines)
-        if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
+        if errors:
             return_level = ERROR
             self.error("Errors received:")
-            errors = self.read_from_file(tmp_stderr_filename,
-                                         verbose=False)
             for line in errors.rstrip().splitlines():
                 if not line or line.isspace():
                     continue
                 line = line.decode("utf-8")
                 self.error(' %s' % line)
-        elif p.returncode:
+        elif returncode:
             return_level = ERROR
         # Clean up.
-        if not save_tmpfiles:
+        if use_tmpfiles and not save_tmpfiles:
             self.rmtree(tmp_stderr_filename, log_level=DEBUG)
             self.rmtree(tmp_stdout_filename, log_level=DEBUG)
-        if p.returncode and throw_exception:
-            raise subprocess.CalledProcessError(p.returncode, command)
-        self.log("Return code: %d" % p.returncode, level=return_level)
+        if returncode and throw_exception:
+            raise subprocess.CalledProcessError(returncode, command)
+        self.log("Return code: %d" % returncode, level=return_level)
         if halt_on_failure and return_level == ERROR:
             self.fatal("Halting on failure while running %s" % command,
-                       exit_code=p.returncode)
+                       exit_code=returncode)
+        if timed_out:
+            return TIMEOUT_STATUS
         # Hm, options on how to return this? I bet often we'll want
         # output_lines[0] with no newline.
         if return_type != 'output':
@@ -719,6 +1445,76 @@ class ScriptMixin(object):
         else:
             return output
 
+    def iter_output_from_command(self, command, cwd=None, env=None,
+                                 halt_on_failure=False,
+                                 throw_exception=False):
+        """Like get_output_from_command, but a generator yielding each
+        line of stdout, without the newline, as soon as the command
+        writes it; e.g.
+
+            for line in self.iter_output_from_command(['hg', 'log']):
+                ...
+
+        Nothing is logged but stderr, which is logged as errors once the
+        command exits, and the return code.  If you stop early, the
+        command is killed.
+        """
+        if cwd:
+            if not os.path.isdir(cwd):
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't run command %s in non-existent directory %s!" %
+                         (command, cwd), level=level)
+                return
+            self.info("Getting output from command: %s in %s", command, cwd)
+        else:
+            self.info("Getting output from command: %s", command)
+        if isinstance(command, list):
+            self.info(lambda: "Copy/paste: %s" % subprocess.list2cmdline(command))
+        shell = True
+        if isinstance(command, list):
+            shell = False
+        start_time = time.time()
+        p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
+                             cwd=cwd, stderr=subprocess.PIPE, env=env)
+        stderr_collector = OutputCollector(p.stderr)
+        stderr_collector.start()
+        fd = p.stdout.fileno()
+        try:
+            for lines in self._iter_output_lines(lambda size: os.read(fd, size)):
+                for line in lines:
+                    yield line
+        except GeneratorExit:
+            if self._poll_process(p) is None:
+                p.kill()
+            self._poll_process(p, block=True)
+            raise
+        self._poll_process(p, block=True)
+        self._record_command_usage(command, cwd, p, start_time)
+        self._add_command_trace(command, cwd, p, start_time)
+        stderr_collector.join()
+        p.stdout.close()
+        p.stderr.close()
+        return_level = DEBUG
+        errors = stderr_collector.query_output()
+        if errors:
+            return_level = ERROR
+            self.error("Errors received:")
+            for line in errors.rstrip().splitlines():
+                if not line or line.isspace():
+                    continue
+                line = line.decode("utf-8")
+                self.error(' %s' % line)
+        elif p.returncode:
+            return_level = ERROR
+        if p.returncode and throw_exception:
+            raise subprocess.CalledProcessError(p.returncode, command)
+        self.log("Return code: %d" % p.returncode, level=return_level)
+        if halt_on_failure and return_level == ERROR:
+            self.fatal("Halting on failure while running %s" % command,
+                       exit_code=p.returncode)
+
 
 # BaseScript {{{1
 class BaseScript(ScriptMixin, LogMixin, object):
@@ -729,11 +1525,19 @@ class BaseScript(ScriptMixin, LogMixin, object):
         self.abs_dirs = None
         if config_options is None:
             config_options = []
-        self.summary_list = []
         self.failures = []
+        self.command_usage = []
+        self.current_action = None
+        self.action_timings = []
         rw_config = BaseConfig(config_options=config_options,
                                **kwargs)
         self.config = rw_config.get_read_only_config()
+        self.summary_store = SummaryStore(
+            max_keys=self.config.get('summary_max_keys', 200),
+            max_exemplars=self.config.get('summary_exemplars', 3))
+        self.trace_events = None
+        if self.config.get('trace'):
+            self.trace_events = []
         self.actions = tuple(rw_config.actions)
         self.all_actions = tuple(rw_config.all_actions)
         self.env = None
@@ -762,8 +1566,9 @@ class BaseScript(ScriptMixin, LogMixin, object):
         pass
 
     def _config_lock(self):
-        """After this point, the config is locked and should not be
-        manipulated (based on mozharness.base.config.ReadOnlyDict)
+        """After this point, the config is locked and can't be
+        manipulated, down to the lists and dicts inside it (based on
+        mozharness.base.config.ReadOnlyDict).
         """
         self.config.lock()
 
@@ -775,19 +1580,114 @@ class BaseScript(ScriptMixin, LogMixin, object):
         elif error_if_missing:
             self.error("No such method %s!" % method_name)
 
+    def _profile_action(self, action, method_name):
+        """Run an action like run() does, but time each of preflight,
+        action and postflight, splitting the time between our own python
+        and the commands we ran; with cprofile_actions, also profile it
+        all into ACTION.pstats in the log dir.
+        """
+        dirs = self.query_abs_dirs()
+        profiler = None
+        if self.config.get('cprofile_actions'):
+            import cProfile
+            profiler = cProfile.Profile()
+        try:
+            for phase_name, error_if_missing in (
+                    ("preflight_%s" % method_name, False),
+                    (method_name, True),
+                    ("postflight_%s" % method_name, False)):
+                if not error_if_missing and not hasattr(self, phase_name):
+                    continue
+                start_times = os.times()
+                start_time = time.time()
+                num_commands = len(self.command_usage)
+                if profiler:
+                    profiler.enable()
+                try:
+                    self._possibly_run_method(phase_name,
+                                              error_if_missing=error_if_missing)
+                finally:
+                    if profiler:
+                        profiler.disable()
+                    self._add_action_timing(action, phase_name, start_time,
+                                            start_times, num_commands)
+        finally:
+            if profiler:
+                self.mkdir_p(dirs['abs_log_dir'])
+                profiler.dump_stats(os.path.join(dirs['abs_log_dir'],
+                                                 "%s.pstats" % action))
+            self.dump_action_timings()
+
+    def _add_action_timing(self, action, phase_name, start_time,
+                           start_times, num_commands):
+        end_times = os.times()
+        commands = self.command_usage[num_commands:]
+        timing = {
+            'action': action,
+            'phase': phase_name,
+            'wall_time': time.time() - start_time,
+            # os.times(): our user and sys time, then our reaped
+            # children's.
+            'harness_cpu_time': (end_times[0] - start_times[0] +
+                                 end_times[1] - start_times[1]),
+            'num_commands': len(commands),
+            'command_wall_time': sum([c['wall_time'] for c in commands]),
+            'command_cpu_time': (end_times[2] - start_times[2] +
+                                 end_times[3] - start_times[3]),
+        }
+        self.action_timings.append(timing)
+        self.info("%s took %.1fs: %.1fs cpu in mozharness, %d commands took %.1fs (%.1fs cpu)." %
+                  (phase_name, timing['wall_time'],
+                   timing['harness_cpu_time'], timing['num_commands'],
+                   timing['command_wall_time'], timing['command_cpu_time']))
+
+    def dump_action_timings(self, file_path=None):
+        """Write self.action_timings as a table to action_timings.txt in
+        the log dir.  The time not spent running commands is
+        roughly wall - command wall; harness cpu is how much of that was
+        our own python, e.g. parsing output, copying files or querying
+        config.
+        """
+        dirs = self.query_abs_dirs()
+        if not file_path:
+            file_path = os.path.join(dirs['abs_log_dir'], "action_timings.txt")
+        self.mkdir_p(os.path.dirname(file_path))
+        row_format = "%-40s %9s %9s %9s %9s %9s\n"
+        fh = open(file_path, 'w')
+        fh.write(row_format % ('phase', 'wall', 'harness', 'commands',
+                               'cmd wall', 'cmd cpu'))
+        for timing in self.action_timings:
+            fh.write(row_format % (timing['phase'],
+                                   "%.2f" % timing['wall_time'],
+                                   "%.2f" % timing['harness_cpu_time'],
+                                   timing['num_commands'],
+                                   "%.2f" % timing['command_wall_time'],
+                                   "%.2f" % timing['command_cpu_time']))
+        fh.close()
+
     def copy_logs_to_upload_dir(self):
         """Copies logs to the upload directory"""
         self.info("Copying logs to upload dir...")
+        self.log_obj.flush()
+        self.log_obj.write_derived_logs()
         log_files = ['localconfig.json']
+        if self.trace_events is not None:
+            log_files.append('trace.json')
         for log_name in self.log_obj.log_files.keys():
             log_files.append(self.log_obj.log_files[log_name])
         dirs = self.query_abs_dirs()
+        # run() dumps the command usage first, but not every caller does.
+        for log_file in ('command_usage.json', self.log_obj.query_binary_log()):
+            if log_file and log_file not in log_files and \
+                    os.path.exists(os.path.join(dirs['abs_log_dir'], log_file)):
+                log_files.append(log_file)
         for log_file in log_files:
             self.copy_to_upload_dir(os.path.join(dirs['abs_log_dir'], log_file),
                                     dest=os.path.join('logs', log_file),
                                     short_desc='%s log' % log_name,
                                     long_desc='%s log' % log_name,
-                                    max_backups=self.config.get("log_max_rotate", 0))
+                                    max_backups=self.config.get("log_max_rotate", 0),
+                                    compression=self.log_obj.log_compression)
 
     def run(self):
         """Default run method.
@@ -810,10 +1710,26 @@ class BaseScript(ScriptMixin, LogMixin, object):
                 self.action_message("Skipping %s step." % action)
             else:
                 method_name = action.replace("-", "_")
-                self.action_message("Running %s step." % action)
-                self._possibly_run_method("preflight_%s" % method_name)
-                self._possibly_run_method(method_name, error_if_missing=True)
-                self._possibly_run_method("postflight_%s" % method_name)
+                self.action_message("Running %s step." % action,
+                                    index_entry={'action': action})
+                self.current_action = action
+                start_time = time.time()
+                try:
+                    if self.config.get('profile_actions') or \
+                            self.config.get('cprofile_actions'):
+                        self._profile_action(action, method_name)
+                    else:
+                        self._possibly_run_method("preflight_%s" % method_name)
+                        self._possibly_run_method(method_name, error_if_missing=True)
+                        self._possibly_run_method("postflight_%s" % method_name)
+                finally:
+                    if self.trace_events is not None:
+                        # Rewritten after each action, so a failed run
+                        # still leaves a trace.
+                        self._add_trace_event(action, 'action', start_time)
+                        self.dump_trace()
+                self.current_action = None
+        self.dump_command_usage()
         self.copy_logs_to_upload_dir()
         sys.exit(self.return_code)
 
@@ -860,6 +1776,54 @@ class BaseScript(ScriptMixin, LogMixin, object):
         fh.close()
         self.info(pprint.pformat(self.config))
 
+    def query_command_usage_by_action(self):
+        """Add up self.command_usage per action."""
+        actions = {}
+        for usage in self.command_usage:
+            totals = actions.setdefault(str(usage['action']), {
+                'num_commands': 0, 'wall_time': 0, 'user_time': 0,
+                'sys_time': 0, 'max_rss_kb': 0, 'read_bytes': 0,
+                'write_bytes': 0,
+            })
+            totals['num_commands'] += 1
+            for key in ('wall_time', 'user_time', 'sys_time', 'read_bytes',
+                        'write_bytes'):
+                totals[key] += usage[key] or 0
+            totals['max_rss_kb'] = max(totals['max_rss_kb'],
+                                       usage['max_rss_kb'] or 0)
+        return actions
+
+    def dump_command_usage(self, file_path=None):
+        """Dump the time and resources each command took, and the totals
+        per action, to command_usage.json next to the logs.
+        """
+        dirs = self.query_abs_dirs()
+        if not file_path:
+            file_path = os.path.join(dirs['abs_log_dir'], "command_usage.json")
+        self.info("Dumping command usage to %s." % file_path)
+        self.mkdir_p(os.path.dirname(file_path))
+        report = {
+            'commands': self.command_usage,
+            'actions': self.query_command_usage_by_action(),
+        }
+        fh = open(file_path, 'w')
+        json.dump(report, fh, sort_keys=True, indent=4)
+        fh.close()
+
+    def dump_trace(self, file_path=None):
+        """Write self.trace_events to trace.json in the log dir, as a
+        timeline of actions, commands and the phases marked by
+        config['trace_phase_markers'] that chrome://tracing can load.
+        """
+        dirs = self.query_abs_dirs()
+        if not file_path:
+            file_path = os.path.join(dirs['abs_log_dir'], "trace.json")
+        self.mkdir_p(os.path.dirname(file_path))
+        fh = open(file_path, 'w')
+        json.dump({'traceEvents': self.trace_events,
+                   'displayTimeUnit': 'ms'}, fh)
+        fh.close()
+
     # logging {{{2
     def new_log_obj(self, default_log_level="info"):
         dirs = self.query_abs_dirs()
@@ -871,6 +1835,10 @@ class BaseScript(ScriptMixin, LogMixin, object):
             "log_format": '%(asctime)s %(levelname)8s - %(message)s',
             "log_to_console": True,
             "append_to_log": False,
+            "async_log": False,
+            "log_store": False,
+            "log_compression": None,
+            "log_index": True,
         }
         log_type = self.config.get("log_type", "multi")
         if log_type == "multi":
@@ -884,29 +1852,48 @@ class BaseScript(ScriptMixin, LogMixin, object):
         else:
             self.log_obj = SimpleFileLogger(**log_config)
 
-    def action_message(self, message):
+    def action_message(self, message, index_entry=None):
         self.info("#####")
-        self.info("##### %s" % message)
+        self.log("##### %s" % message, index_entry=index_entry)
         self.info("#####")
 
     def summary(self):
         """Print out all the summary lines added via add_summary()
         throughout the script.
 
-        I'd like to revisit how to do this in a prettier fashion.
+        Repeats of a message (same level, same text but for paths and
+        numbers; see SummaryStore) are printed once, with a count and up
+        to summary_exemplars examples.
         """
         self.action_message("%s summary:" % self.__class__.__name__)
-        if self.summary_list:
-            for item in self.summary_list:
+        for entry in self.summary_store:
+            lines = list(entry['exemplars'])
+            if entry['count'] > 1:
+                lines = ["%6dx %s" % (entry['count'], lines[0])] + \
+                        ["        %s" % line for line in lines[1:]]
+            for line in lines:
                 try:
-                    self.log(item['message'], level=item['level'])
+                    self.log(line, level=entry['level'])
                 except ValueError:
                     """log is closed; print as a default. Ran into this
                     when calling from __del__()"""
-                    print "### Log is closed! (%s)" % item['message']
+                    print "### Log is closed! (%s)" % line
+        if self.summary_store.num_dropped:
+            self.warning("%d more summary messages not shown; summary_max_keys is %d." %
+                         (self.summary_store.num_dropped,
+                          self.summary_store.max_keys))
+        if self.command_usage:
+            num_commands = self.config.get('command_usage_summary_count', 5)
+            self.info("Most expensive commands:")
+            for usage in sorted(self.command_usage, reverse=True,
+                                key=lambda u: u['wall_time'])[:num_commands]:
+                self.info(" %.1fs (user %ss, sys %ss) in %s: %s" %
+                          (usage['wall_time'], usage['user_time'],
+                           usage['sys_time'], usage['action'],
+                           usage['command']))
 
     def add_summary(self, message, level=INFO):
-        self.summary_list.append({'message': message, 'level': level})
+        self.summary_store.add(message, level=level)
         # TODO write to a summary-only log?
         # Summaries need a lot more love.
         self.log(message, level=level)
@@ -932,9 +1919,14 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
     def copy_to_upload_dir(self, target, dest=None, short_desc="unknown",
                            long_desc="unknown", log_level=DEBUG,
-                           error_level=ERROR, max_backups=None):
+                           error_level=ERROR, max_backups=None,
+                           compression=None):
         """Copy target file to upload_dir/dest.
 
+        With compression ('gzip' or 'zstd'), an uncompressed target is
+        compressed on the way, and the extension added to dest; a
+        target that's already compressed is copied as it is.
+
         Potentially update a manifest in the future if we go that route.
 
         Currently only copies a single file; would be nice to allow for
@@ -953,6 +1945,9 @@ class BaseScript(ScriptMixin, LogMixin, object):
         else:
             dest_file = os.path.basename(dest)
             dest_dir = os.path.join(dirs['abs_upload_dir'], os.path.dirname(dest))
+        compress = bool(compression) and not query_compression(target)
+        if compress:
+            dest_file += COMPRESSION_EXTENSIONS[compression]
         dest = os.path.join(dest_dir, dest_file)
         if not os.path.exists(target):
             self.log("%s doesn't exist!" % target, level=error_level)
@@ -986,7 +1981,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
                 if self.rmtree(dest, log_level=log_level):
                     self.log("Unable to remove %s!" % dest, level=error_level)
                     return -1
-        self.copyfile(target, dest, log_level=log_level)
+        self.copyfile(target, dest, log_level=log_level, compress=compress)
         if os.path.exists(dest):
             return dest
         else:
@@ -8,7 +8,6 @@
 """
 
 import os
-import urllib2
 try:
     import simplejson as json
     assert json
@@ -103,6 +102,7 @@ class TransferMixin(object):
             return -3
 
     def load_json_from_url(self, url, timeout=30):
+        import urllib2
         self.debug("Attempting to download %s; timeout=%i" % (url, timeout))
         r = urllib2.urlopen(url, timeout=timeout)
         j = json.load(r)
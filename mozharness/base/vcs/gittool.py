@@ -1,6 +1,5 @@
 import os
 import re
-import urlparse
 
 from mozharness.base.script import ScriptMixin
 from mozharness.base.log import LogMixin, OutputParser
@@ -68,6 +67,7 @@ class GittoolVCS(ScriptMixin, LogMixin):
             cmd.extend(['-r', revision])
 
         for base_mirror_url in self.config.get('gittool_base_mirror_urls', self.config.get('vcs_base_mirror_urls', [])):
+            import urlparse
             bits = urlparse.urlparse(repo)
             mirror_url = urlparse.urljoin(base_mirror_url, bits.path)
             cmd.extend(['--mirror', mirror_url])
@@ -1,6 +1,5 @@
 import os
 import re
-import urlparse
 
 from mozharness.base.script import ScriptMixin
 from mozharness.base.log import LogMixin, OutputParser, WARNING
@@ -74,6 +73,7 @@ class HgtoolVCS(ScriptMixin, LogMixin):
             cmd.extend(['-r', revision])
 
         for base_mirror_url in self.config.get('hgtool_base_mirror_urls', self.config.get('vcs_base_mirror_urls', [])):
+            import urlparse
             bits = urlparse.urlparse(repo)
             mirror_url = urlparse.urljoin(base_mirror_url, bits.path)
             cmd.extend(['--mirror', mirror_url])
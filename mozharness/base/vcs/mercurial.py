@@ -13,7 +13,6 @@ http://hg.mozilla.org/build/tools/file/cf265ea8fb5e/lib/python/util/hg.py .
 import os
 import re
 import subprocess
-from urlparse import urlsplit
 
 # TODO delete
 import sys
@@ -93,6 +92,7 @@ class MercurialVCS(ScriptMixin, LogMixin, object):
         if repo.startswith("/"):
             return repo.lstrip("/")
         else:
+            from urlparse import urlsplit
             return urlsplit(repo).path.lstrip("/")
 
     def get_revision_from_path(self, path):
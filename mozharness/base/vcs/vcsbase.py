@@ -7,7 +7,6 @@
 """Generic VCS support.
 """
 
-from copy import deepcopy
 import os
 import sys
 
@@ -95,9 +94,9 @@ class VCSMixin(object):
         self.mkdir_p(parent_dir)
         self.chdir(parent_dir)
         revision_dict = {}
-        kwargs_orig = deepcopy(kwargs)
+        kwargs_orig = kwargs
         for repo_dict in repo_list:
-            kwargs = deepcopy(kwargs_orig)
+            kwargs = kwargs_orig.copy()
             kwargs.update(repo_dict)
             if tag_override:
                 kwargs['revision'] = tag_override
@@ -8,7 +8,6 @@
 """
 
 import os
-from urlparse import urljoin
 import sys
 
 sys.path.insert(1, os.path.dirname(sys.path[0]))
@@ -46,6 +45,9 @@ class LocalesMixin(ChunkingMixin):
                 locales = self.parse_locales_file(locales_file)
             else:
                 self.fatal("No way to determine locales!")
+        else:
+            # c['locales'] is locked.
+            locales = list(locales)
         for locale in ignore_locales:
             if locale in locales:
                 self.debug("Ignoring locale %s." % locale)
@@ -164,8 +166,8 @@ class LocalesMixin(ChunkingMixin):
             if c.get("user_repo_override"):
                 replace_dict['user_repo_override'] = c['user_repo_override']
                 for repo_dict in c['l10n_repos']:
-                    repo_dict['repo'] = repo_dict['repo'] % replace_dict
-                    repos.append(repo_dict)
+                    repos.append(repo_dict.overlay(
+                        repo=repo_dict['repo'] % replace_dict))
             else:
                 repos = c.get("l10n_repos")
             self.vcs_checkout_repos(repos, tag_override=c.get('tag_override'))
@@ -194,6 +196,7 @@ class GaiaLocalesMixin(object):
     gaia_locale_revisions = None
 
     def pull_gaia_locale_source(self, l10n_config, locales, base_dir):
+        from urlparse import urljoin
         root = l10n_config['root']
         # urljoin will strip the last part of root if it doesn't end with "/"
         if not root.endswith('/'):
@@ -123,11 +123,11 @@ class MultiLocaleBuild(LocalesMixin, MercurialScript):
         if c.get("user_repo_override"):
             replace_dict['user_repo_override'] = c['user_repo_override']
             for repo_dict in c['repos']:
-                repo_dict['repo'] = repo_dict['repo'] % replace_dict
-                repos.append(repo_dict)
+                repos.append(repo_dict.overlay(
+                    repo=repo_dict['repo'] % replace_dict))
         else:
             repos = c['repos']
-        self.vcs_checkout_repos(c['repos'], tag_override=c.get('tag_override'))
+        self.vcs_checkout_repos(repos, tag_override=c.get('tag_override'))
 
     # pull_locale_source() defined in LocalesMixin.
 
@@ -1,7 +1,6 @@
 """
 Module for handling repo style XML manifests
 """
-import xml.dom.minidom
 import os
 
 
@@ -10,6 +9,7 @@ def load_manifest(filename):
     Loads manifest from `filename`
     Processes any <include name="..." /> nodes
     """
+    import xml.dom.minidom
     doc = xml.dom.minidom.parse(filename)
     # Find all <include> nodes
     for i in doc.getElementsByTagName('include'):
@@ -18,7 +18,7 @@ import sys
 import time
 
 from mozharness.base.errors import ADBErrorList
-from mozharness.base.log import LogMixin, DEBUG
+from mozharness.base.log import LogMixin, OutputParser, DEBUG
 from mozharness.base.script import ScriptMixin
 
 
@@ -264,13 +264,20 @@ class ADBDeviceHandler(BaseDeviceHandler):
         device_root = None
         device_id = self.query_device_id()
         adb = self.query_exe('adb')
-        output = self.get_output_from_command("%s -s %s shell df" % (adb, device_id),
-                                              silent=silent)
+        (status, captures) = self.run_command(
+            "%s -s %s shell df" % (adb, device_id),
+            output_parser=OutputParser(config=self.config, log_obj=self.log_obj,
+                                       log_output=not silent),
+            capture_list=[
+                {'name': 'not_found', 'regex': re.compile(r'.* not found.*')},
+                {'name': 'sdcard', 'regex': re.compile(r'/mnt/sdcard')},
+            ])
         # TODO this assumes we're connected; error checking?
-        if output is None or ' not found' in str(output):
-            self.error("Can't get output from 'adb shell df'!\n%s" % output)
+        if status or captures['not_found']:
+            self.error("Can't get output from 'adb shell df'! %s" %
+                       (captures['not_found'] or ''))
             return None
-        if "/mnt/sdcard" in output:
+        if captures['sdcard']:
             device_root = "/mnt/sdcard/tests"
         else:
             device_root = "/data/local/tmp/tests"
@@ -9,7 +9,6 @@
 
 import os
 import re
-import socket
 import sys
 
 from time import sleep
@@ -27,6 +26,7 @@ class MozpoolMixin(object):
     def determine_mozpool_host(self, device):
         if "mobile_imaging_format" in self.config:
             self.mobile_imaging_format = self.config["mobile_imaging_format"]
+        import socket
         fqdn = socket.getfqdn(device)
         vlan_match = re.search("%s\.p([0-9]+)\.releng.*" % device, fqdn)
         if vlan_match:
@@ -226,7 +226,7 @@ class Talos(TestingMixin, BaseScript):
             except KeyError, e:
                 self.error("Badly formed talos_json for suite %s; KeyError trying to access talos_config['suites'][%s]['tests']: %s" % (c['suite'], c['suite'], str(e)))
         elif c['tests']:
-            self.tests = c['tests']
+            self.tests = list(c['tests'])
         # Ignore these tests, specifically so we can not run a11yr on osx
         if c.get('ignore_tests'):
             for test in c['ignore_tests']:
@@ -386,7 +386,7 @@ class Talos(TestingMixin, BaseScript):
         when using the talos json, we have to wrap that method here."""
         if self.query_talos_json_config():
             talos_url = self.query_talos_url()
-            virtualenv_modules = self.config.get('virtualenv_modules', [])
+            virtualenv_modules = list(self.config.get('virtualenv_modules', []))
             if 'talos' in virtualenv_modules:
                 i = virtualenv_modules.index('talos')
                 virtualenv_modules[i] = {'talos': talos_url}
@@ -7,7 +7,6 @@
 
 import copy
 import os
-import platform
 
 from mozharness.base.errors import BaseErrorList
 from mozharness.base.log import FATAL
@@ -284,6 +283,7 @@ Did you run with --create-virtualenv? Is mozinstall in virtualenv_modules?""")
         if os.path.isdir(os.path.join(dirs['abs_work_dir'], 'tools', 'breakpad')):
             # find binary for platform/architecture
             path = os.path.join(dirs['abs_work_dir'], 'tools', 'breakpad', '%s', 'minidump_stackwalk')
+            import platform
             pltfrm = platform.platform().lower()
             arch = platform.architecture()
             if 'linux' in pltfrm:
@@ -317,6 +317,7 @@ Did you run with --create-virtualenv? Is mozinstall in virtualenv_modules?""")
             if not suite['enabled']:
                 continue
             if suite.get('architectures'):
+                import platform
                 arch = platform.architecture()[0]
                 if arch not in suite['architectures']:
                     continue
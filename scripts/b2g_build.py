@@ -669,7 +669,7 @@ class B2GBuild(LocalesMixin, MockMixin, PurgeMixin, BaseScript, VCSMixin, Toolto
             self.run_command(["cp", "-p", "sources.xml", "sources.xml.original"], cwd=dirs['work_dir'])
 
         gecko_config = self.load_gecko_config()
-        extra_tarballs = self.config.get('additional_source_tarballs', [])
+        extra_tarballs = list(self.config.get('additional_source_tarballs', []))
         if 'additional_source_tarballs' in gecko_config:
             extra_tarballs.extend(gecko_config['additional_source_tarballs'])
 
@@ -9,12 +9,18 @@
 Verify the .json and .py files in the configs/ directory are well-formed.
 Further tests to verify validity would be desirable.
 
+Files are tested in a pool of --jobs processes, so one config can't
+affect another.  The sha1s of good files are kept in --results-cache,
+and unchanged files aren't retested.
+
 This is also a good example script to look at to understand mozharness.
 """
 
+import hashlib
 import os
 import pprint
 import sys
+import time
 try:
     import simplejson as json
 except ImportError:
@@ -24,6 +30,45 @@ sys.path.insert(1, os.path.dirname(sys.path[0]))
 
 from mozharness.base.script import BaseScript
 
+
+def query_sha1(config_file):
+    fh = open(config_file, 'rb')
+    try:
+        return hashlib.sha1(fh.read()).hexdigest()
+    finally:
+        fh.close()
+
+
+def test_config_file(config_file):
+    """Test one config file; run in a worker process.
+
+    Returns a dict with the file's sha1, the seconds it took to load, and
+    'error': None if it's good, 'invalid' if it doesn't load, or
+    'no_config' for python that doesn't create a config dictionary.
+    """
+    result = {'config_file': config_file, 'sha1': query_sha1(config_file),
+              'error': None, 'message': None}
+    start = time.time()
+    try:
+        if config_file.endswith(".json"):
+            fh = open(config_file)
+            try:
+                json.loads(fh.read())
+            finally:
+                fh.close()
+        else:
+            global_dict = {}
+            local_dict = {}
+            execfile(config_file, global_dict, local_dict)
+            if not ('config' in local_dict and isinstance(local_dict['config'], dict)):
+                result['error'] = 'no_config'
+    except:
+        result['error'] = 'invalid'
+        result['message'] = pprint.pformat(sys.exc_info()[1])
+    result['seconds'] = time.time() - start
+    return result
+
+
 # ConfigTest {{{1
 class ConfigTest(BaseScript):
     config_options = [[
@@ -32,10 +77,26 @@ class ConfigTest(BaseScript):
       "dest": "test_files",
       "help": "Specify which config files to test"
      }
+    ], [
+     ["--jobs", "-j"],
+     {"action": "store",
+      "type": "int",
+      "dest": "jobs",
+      "help": "Specify the number of processes to test with "
+              "(default: the number of cpus)"
+     }
+    ], [
+     ["--results-cache"],
+     {"action": "store",
+      "dest": "results_cache",
+      "help": "Specify the file to keep the sha1s of good config files in (default: configtest_results.json in the work dir)"
+     }
     ]]
+    num_slowest_files = 5
 
     def __init__(self, require_config_file=False):
         self.config_files = []
+        self.good_sha1s = None
         BaseScript.__init__(self, config_options=self.config_options,
                             all_actions=['list-config-files',
                                          'test-json-configs',
@@ -79,26 +140,100 @@ class ConfigTest(BaseScript):
         for config_file in config_files:
             self.info(config_file)
 
+    def query_results_cache(self):
+        c = self.config
+        if c.get('results_cache'):
+            return c['results_cache']
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'configtest_results.json')
+
+    def query_good_sha1s(self):
+        """Return a dict of config file path to the sha1 it had when it
+        last tested good.
+        """
+        if self.good_sha1s is not None:
+            return self.good_sha1s
+        self.good_sha1s = {}
+        results_cache = self.query_results_cache()
+        if os.path.exists(results_cache):
+            try:
+                self.good_sha1s = json.loads(self.read_from_file(results_cache,
+                                                                 verbose=False))
+            except ValueError:
+                self.warning("Ignoring unreadable %s." % results_cache)
+        return self.good_sha1s
+
+    def write_good_sha1s(self):
+        results_cache = self.query_results_cache()
+        self.mkdir_p(os.path.dirname(os.path.abspath(results_cache)))
+        self.write_to_file(results_cache,
+                           json.dumps(self.query_good_sha1s(), indent=2,
+                                      sort_keys=True),
+                           verbose=False)
+
+    def _test_config_files(self, suffix, file_type):
+        """Test the config files ending in suffix, skipping the ones that
+        are unchanged since they last tested good.
+
+        Return the number of files and the number of good ones.
+        """
+        c = self.config
+        config_files = [f for f in self.query_config_files() if f.endswith(suffix)]
+        good_sha1s = self.query_good_sha1s()
+        num_good = 0
+        to_test = []
+        for config_file in config_files:
+            key = os.path.abspath(config_file)
+            if key in good_sha1s and good_sha1s[key] == query_sha1(config_file):
+                self.info("%s is unchanged since it last tested good." % config_file)
+                num_good += 1
+            else:
+                to_test.append(config_file)
+        # multiprocessing is imported here, not for the --jobs default,
+        # to keep script startup fast.
+        import multiprocessing
+        jobs = max(1, c.get('jobs') or multiprocessing.cpu_count())
+        if to_test:
+            self.info("Testing %d %s config files with %d processes." %
+                      (len(to_test), suffix, jobs))
+        if jobs == 1 or len(to_test) <= 1:
+            results = map(test_config_file, to_test)
+        else:
+            pool = multiprocessing.Pool(processes=jobs)
+            try:
+                results = pool.map(test_config_file, to_test)
+            finally:
+                pool.close()
+                pool.join()
+        for result in results:
+            config_file = result['config_file']
+            self.info("Tested %s in %.1fms." % (config_file,
+                                               result['seconds'] * 1000))
+            if result['error'] == 'invalid':
+                self.add_summary("%s is invalid %s." % (config_file, file_type),
+                                 level="error")
+                self.error(result['message'])
+            elif result['error'] == 'no_config':
+                self.add_summary("%s is valid python, but doesn't create a config dictionary." %
+                                 config_file, level="error")
+            else:
+                self.info("Good.")
+                good_sha1s[os.path.abspath(config_file)] = result['sha1']
+                num_good += 1
+        if results:
+            self.info("Slowest %s config files:" % suffix)
+            for result in sorted(results, reverse=True,
+                                 key=lambda r: r['seconds'])[:self.num_slowest_files]:
+                self.info(" %.1fms %s" % (result['seconds'] * 1000,
+                                          result['config_file']))
+            self.write_good_sha1s()
+        return (len(config_files), num_good)
+
     def test_json_configs(self):
         """ Currently only "is this well-formed json?"
 
         """
-        config_files = self.query_config_files()
-        filecount = [0, 0]
-        for config_file in config_files:
-            if config_file.endswith(".json"):
-                filecount[0] += 1
-                self.info("Testing %s." % config_file)
-                contents = self.read_from_file(config_file, verbose=False)
-                try:
-                    json.loads(contents)
-                except ValueError:
-                    self.add_summary("%s is invalid json." % config_file,
-                                     level="error")
-                    self.error(pprint.pformat(sys.exc_info()[1]))
-                else:
-                    self.info("Good.")
-                    filecount[1] += 1
+        filecount = self._test_config_files(".json", "json")
         if filecount[0]:
             self.add_summary("%d of %d json config files were good." %
                              (filecount[1], filecount[0]))
@@ -109,27 +244,7 @@ class ConfigTest(BaseScript):
         """Currently only "will this give me a config dictionary?"
 
         """
-        config_files = self.query_config_files()
-        filecount = [0, 0]
-        for config_file in config_files:
-            if config_file.endswith(".py"):
-                filecount[0] += 1
-                self.info("Testing %s." % config_file)
-                global_dict = {}
-                local_dict = {}
-                try:
-                    execfile(config_file, global_dict, local_dict)
-                except:
-                    self.add_summary("%s is invalid python." % config_file,
-                                     level="error")
-                    self.error(pprint.pformat(sys.exc_info()[1]))
-                else:
-                    if 'config' in local_dict and isinstance(local_dict['config'], dict):
-                        self.info("Good.")
-                        filecount[1] += 1
-                    else:
-                        self.add_summary("%s is valid python, but doesn't create a config dictionary." %
-                                         config_file, level="error")
+        filecount = self._test_config_files(".py", "python")
         if filecount[0]:
             self.add_summary("%d of %d python config files were good." %
                              (filecount[1], filecount[0]))
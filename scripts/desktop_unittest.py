@@ -265,7 +265,7 @@ class DesktopUnittest(TestingMixin, MercurialScript):
 
         target_unzip_dirs = None
         if c['specific_tests_zip_dirs']:
-            target_unzip_dirs = c['minimum_tests_zip_dirs']
+            target_unzip_dirs = list(c['minimum_tests_zip_dirs'])
             for category in c['specific_tests_zip_dirs'].keys():
                 if c['run_all_suites'] or self._query_specified_suites(category) \
                         or 'run-tests' not in self.actions:
@@ -90,7 +90,7 @@ class GaiaUnitTest(TestingMixin, TooltoolMixin, MercurialScript):
 
     def pull(self, **kwargs):
         dirs = self.query_abs_dirs()
-        repos = copy.deepcopy(self.config.get('repos', []))
+        repos = list(self.config.get('repos', []))
         repos.append({'repo': self.config.get('gaia_repo'),
                       'revision': 'default',
                       'dest': 'gaia',
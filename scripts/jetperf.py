@@ -112,7 +112,7 @@ class JetPerf(Talos, MercurialScript):
             self.fatal("%s not found; make sure you clone the addon-sdk repo first" % cfx)
 
         # get addons
-        addons = self.config['addon-directories']
+        addons = list(self.config['addon-directories'])
         if os.path.exists(self.test_addons_clone):
             addons.extend(self.addons_from_directory(self.test_addons_clone))
         if not addons:
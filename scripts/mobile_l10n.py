@@ -10,7 +10,6 @@ This currently supports nightly and release single locale repacks for
 Android.  This also creates nightly updates.
 """
 
-from copy import deepcopy
 import os
 import re
 import subprocess
@@ -121,7 +120,7 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
         )
         self.base_package_name = None
         self.buildid = None
-        self.make_ident_output = None
+        self.make_ident_captures = None
         self.repack_env = None
         self.revision = None
         self.upload_env = None
@@ -165,24 +164,29 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
         self.upload_env = upload_env
         return self.upload_env
 
-    def _query_make_ident_output(self):
-        """Get |make ident| output from the objdir.
+    def _query_make_ident(self):
+        """Get the buildid and revision from |make ident| in the objdir.
         Only valid after setup is run.
         """
-        if self.make_ident_output:
-            return self.make_ident_output
+        if self.make_ident_captures:
+            return self.make_ident_captures
         env = self.query_repack_env()
         dirs = self.query_abs_dirs()
-        output = self.get_output_from_command_m(["make", "ident"],
-                                                cwd=dirs['abs_locales_dir'],
-                                                env=env,
-                                                silent=True,
-                                                halt_on_failure=True)
-        parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                              error_list=MakefileErrorList)
-        parser.add_lines(output)
-        self.make_ident_output = output
-        return output
+        (status, captures) = self.run_command_m(
+            ["make", "ident"],
+            cwd=dirs['abs_locales_dir'],
+            env=env,
+            error_list=MakefileErrorList,
+            halt_on_failure=True,
+            capture_list=[
+                {'name': 'buildid', 'regex': re.compile(r"^buildid (\d+)"),
+                 'keep': 'last'},
+                {'name': 'revision',
+                 'regex': re.compile(r"^gecko_revision ([0-9a-f]{12}\+?)"),
+                 'keep': 'last'},
+            ])
+        self.make_ident_captures = captures
+        return captures
 
     def query_buildid(self):
         """Get buildid from the objdir.
@@ -190,12 +194,7 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
         """
         if self.buildid:
             return self.buildid
-        r = re.compile("buildid (\d+)")
-        output = self._query_make_ident_output()
-        for line in output.splitlines():
-            m = r.match(line)
-            if m:
-                self.buildid = m.groups()[0]
+        self.buildid = self._query_make_ident()['buildid']
         return self.buildid
 
     def query_revision(self):
@@ -204,12 +203,7 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
         """
         if self.revision:
             return self.revision
-        r = re.compile(r"gecko_revision ([0-9a-f]{12}\+?)")
-        output = self._query_make_ident_output()
-        for line in output.splitlines():
-            m = r.match(line)
-            if m:
-                self.revision = m.groups()[0]
+        self.revision = self._query_make_ident()['revision']
         return self.revision
 
     def _query_make_variable(self, variable, make_args=None):
@@ -298,10 +292,9 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
         replace_dict = {}
         if c.get("user_repo_override"):
             replace_dict['user_repo_override'] = c['user_repo_override']
-            # deepcopy() needed because of self.config lock bug :(
-            for repo_dict in deepcopy(c['repos']):
-                repo_dict['repo'] = repo_dict['repo'] % replace_dict
-                repos.append(repo_dict)
+            for repo_dict in c['repos']:
+                repos.append(repo_dict.overlay(
+                    repo=repo_dict['repo'] % replace_dict))
         else:
             repos = c['repos']
         self.vcs_checkout_repos(repos, parent_dir=dirs['abs_work_dir'],
@@ -434,33 +427,26 @@ class MobileSingleLocale(MockMixin, LocalesMixin, ReleaseMixin,
             total_count += 1
             if c.get('base_post_upload_cmd'):
                 upload_env['POST_UPLOAD_CMD'] = c['base_post_upload_cmd'] % {'version': version, 'locale': locale, 'buildnum': str(buildnum)}
-            output = self.get_output_from_command_m(
-                # Ugly hack to avoid |make upload| stderr from showing up
-                # as get_output_from_command errors
-                "%s upload AB_CD=%s 2>&1" % (make, locale),
+            package_name = base_package_name % {'locale': locale}
+            (num_errors, captures) = self.run_command_m(
+                "%s upload AB_CD=%s" % (make, locale),
                 cwd=dirs['abs_locales_dir'],
                 env=upload_env,
-                silent=True
-            )
-            parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                                  error_list=MakefileErrorList)
-            parser.add_lines(output)
-            if parser.num_errors:
+                error_list=MakefileErrorList,
+                return_type='num_errors',
+                capture_list=[
+                    {'name': 'upload_url',
+                     'regex': re.compile("^(http.*%s)" % package_name),
+                     'keep': 'last'},
+                ])
+            if num_errors:
                 self.add_failure(locale, message="%s failed in make upload!" % (locale))
                 continue
-            package_name = base_package_name % {'locale': locale}
-            r = re.compile("(http.*%s)" % package_name)
-            success = False
-            for line in output.splitlines():
-                m = r.match(line)
-                if m:
-                    self.upload_urls[locale] = m.groups()[0]
-                    self.info("Found upload url %s" % self.upload_urls[locale])
-                    success = True
-            if not success:
+            if not captures['upload_url']:
                 self.add_failure(locale, message="Failed to detect %s url in make upload!" % (locale))
-                print output
                 continue
+            self.upload_urls[locale] = captures['upload_url']
+            self.info("Found upload url %s" % self.upload_urls[locale])
             success_count += 1
         self.summarize_success_count(success_count, total_count,
                                      message="Uploaded %d of %d binaries successfully.")
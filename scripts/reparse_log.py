@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""reparse_log.py
+
+Re-run error classification over an existing log, e.g. a *_raw.log from
+MultiFileLogger, after changing an error list or an OutputParser subclass.
+
+  scripts/reparse_log.py --log-file build_raw.log --error-list HgErrorList
+  scripts/reparse_log.py --log-file test_raw.log \\
+      --output-parser mozharness.mozilla.testing.unittest.DesktopUnittestOutputParser \\
+      --parser-option suite_category=mochitest
+
+The log is split into line-aligned chunks which are parsed across a pool
+of processes.  The number of errors and warnings, the worst log level and
+the matching lines are merged back in order.  Anything else a parser
+subclass keeps track of is per-chunk and isn't merged, and context_lines
+don't reach across chunk boundaries.
+"""
+
+import mmap
+import os
+import sys
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.log import OutputParser, INFO, WARNING, ERROR, \
+    CRITICAL, FATAL
+from mozharness.base.script import BaseScript
+
+ERROR_LIST_MODULES = ['mozharness.base.errors',
+                      'mozharness.mozilla.testing.errors']
+
+
+def _import_name(name, modules=None):
+    """Import 'package.module.Name', or look up Name in modules."""
+    if '.' in name:
+        module_name, attr = name.rsplit('.', 1)
+        modules = [module_name]
+    else:
+        attr = name
+    for module_name in modules or []:
+        __import__(module_name)
+        module = sys.modules[module_name]
+        if hasattr(module, attr):
+            return getattr(module, attr)
+    raise ImportError("Can't find %s in %s!" % (attr, modules))
+
+
+def query_log_chunks(log_path, num_chunks):
+    """Split log_path into about num_chunks (start, end) byte ranges that
+    begin and end on line boundaries.
+    """
+    size = os.path.getsize(log_path)
+    offsets = [0]
+    fh = open(log_path, 'rb')
+    try:
+        for i in range(1, num_chunks):
+            target = size * i / num_chunks
+            if target <= offsets[-1]:
+                continue
+            # Seek back a byte so a chunk that already starts on a line
+            # boundary keeps its first line.
+            fh.seek(target - 1)
+            fh.readline()
+            position = fh.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    finally:
+        fh.close()
+    offsets.append(size)
+    return zip(offsets[:-1], offsets[1:])
+
+
+class SummaryCollector(object):
+    """Stand-in log_obj for the worker processes: keep the lines at
+    WARNING or above instead of logging them.
+    """
+    def __init__(self):
+        self.summary = []
+
+    def is_enabled_for(self, level):
+        return level in (WARNING, ERROR, CRITICAL, FATAL)
+
+    def log_message(self, message, level=INFO, exit_code=-1):
+        if self.is_enabled_for(level):
+            self.summary.append((level, message))
+
+
+def reparse_chunk(args):
+    """Parse one (start, end) byte range of a log; run in a worker process.
+    """
+    (log_path, start, end, error_list_name, parser_name, parser_options) = args
+    collector = SummaryCollector()
+    parser_class = OutputParser
+    if parser_name:
+        parser_class = _import_name(parser_name)
+    kwargs = dict(parser_options)
+    if error_list_name:
+        kwargs['error_list'] = _import_name(error_list_name, ERROR_LIST_MODULES)
+    parser = parser_class(config={'log_level': INFO}, log_obj=collector,
+                          **kwargs)
+    if end > start:
+        fh = open(log_path, 'rb')
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            buf.seek(start)
+            while buf.tell() < end:
+                line = buf.readline()
+                if not line:
+                    break
+                # Command output is indented one space in mozharness logs;
+                # strip that so anchored regexes still match.
+                if line.startswith(' '):
+                    line = line[1:]
+                parser.add_lines(line)
+            parser.finish()
+        finally:
+            buf.close()
+            fh.close()
+    return {
+        'num_errors': parser.num_errors,
+        'num_warnings': parser.num_warnings,
+        'worst_log_level': parser.worst_log_level,
+        'summary': collector.summary,
+    }
+
+
+# ReparseLog {{{1
+class ReparseLog(BaseScript):
+    config_options = [[
+     ["--log-file"],
+     {"action": "store",
+      "dest": "log_file",
+      "help": "Specify the log to reparse"
+     }
+    ], [
+     ["--error-list"],
+     {"action": "store",
+      "dest": "error_list",
+      "help": "Specify the error list, e.g. HgErrorList or package.module.SomeErrorList"
+     }
+    ], [
+     ["--output-parser"],
+     {"action": "store",
+      "dest": "output_parser",
+      "help": "Specify an OutputParser subclass, e.g. mozharness.mozilla.testing.unittest.DesktopUnittestOutputParser"
+     }
+    ], [
+     ["--parser-option"],
+     {"action": "extend",
+      "dest": "parser_options",
+      "metavar": "KEY=VALUE",
+      "help": "Specify keyword arguments for the output parser"
+     }
+    ], [
+     ["--jobs", "-j"],
+     {"action": "store",
+      "type": "int",
+      "dest": "jobs",
+      "help": "Specify the number of processes to parse with "
+              "(default: the number of cpus)"
+     }
+    ], [
+     ["--chunk-size"],
+     {"action": "store",
+      "type": "int",
+      "dest": "chunk_size",
+      "default": 32,
+      "help": "Specify the size of each chunk in MB"
+     }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['reparse',
+                                         'summary',
+                                         ],
+                            require_config_file=require_config_file)
+
+    def query_parser_options(self):
+        parser_options = {}
+        for option in self.config.get('parser_options') or []:
+            if '=' not in option:
+                self.fatal("--parser-option %s isn't KEY=VALUE!" % option)
+            key, value = option.split('=', 1)
+            parser_options[key] = value
+        return parser_options
+
+    def reparse(self):
+        c = self.config
+        log_path = c.get('log_file')
+        if not log_path or not os.path.exists(log_path):
+            self.fatal("Please specify an existing --log-file!")
+        if not c.get('error_list') and not c.get('output_parser'):
+            self.fatal("Please specify --error-list and/or --output-parser!")
+        # multiprocessing is imported here, not for the --jobs default,
+        # to keep script startup fast.
+        import multiprocessing
+        jobs = max(1, c.get('jobs') or multiprocessing.cpu_count())
+        size = os.path.getsize(log_path)
+        num_chunks = max(jobs, size / (c['chunk_size'] * 1024 * 1024) + 1)
+        parser_options = self.query_parser_options()
+        tasks = [(log_path, start, end, c.get('error_list'),
+                  c.get('output_parser'), parser_options)
+                 for (start, end) in query_log_chunks(log_path, num_chunks)]
+        self.info("Parsing %s in %d chunks with %d processes." %
+                  (log_path, len(tasks), jobs))
+        if jobs == 1 or len(tasks) == 1:
+            results = map(reparse_chunk, tasks)
+        else:
+            pool = multiprocessing.Pool(processes=jobs)
+            try:
+                results = pool.map(reparse_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        # A parser of our own to hold the totals.
+        totals = OutputParser(config=self.config, log_obj=self.log_obj)
+        for result in results:
+            totals.num_errors += result['num_errors']
+            totals.num_warnings += result['num_warnings']
+            totals.worst_log_level = totals.worst_level(
+                result['worst_log_level'], totals.worst_log_level)
+            for level, message in result['summary']:
+                if level == FATAL:
+                    # Don't exit just because the original job did.
+                    level = CRITICAL
+                self.log(message, level=level)
+        self.add_summary("%s: %d errors, %d warnings, worst log level %s." %
+                         (log_path, totals.num_errors, totals.num_warnings,
+                          totals.worst_log_level))
+
+# __main__ {{{1
+if __name__ == '__main__':
+    reparse_log = ReparseLog()
+    reparse_log.run()
@@ -1,4 +1,7 @@
+import copy
 import os
+import shutil
+import time
 import unittest
 
 JSON_TYPE = None
@@ -81,6 +84,99 @@ class TestParseConfigFile(unittest.TestCase):
         self.assertEqual(c._config['keep_string'], "don't change me")
 
 
+class TestConfigCache(unittest.TestCase):
+    cache_dir = "test_config_cache"
+
+    def setUp(self):
+        self.cleanup()
+
+    def tearDown(self):
+        self.cleanup()
+
+    def cleanup(self):
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+    def _write(self, file_name, contents):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        file_path = os.path.join(self.cache_dir, file_name)
+        fh = open(file_path, 'w')
+        fh.write(contents)
+        fh.close()
+        return file_path
+
+    def test_same_as_uncached(self):
+        for file_name in ("test/test.json", "test/test.py"):
+            uncached = config.parse_config_file(file_name)
+            for i in range(2):
+                self.assertEqual(config.parse_config_file(file_name, cache_dir=self.cache_dir),
+                                 uncached)
+            self.assertTrue(os.path.exists(config.query_config_cache_path(
+                self.cache_dir, os.path.join(MH_DIR, "configs", file_name))))
+
+    def test_invalidated_by_change(self):
+        json_path = self._write("cached.json", '{"a": 1}')
+        py_path = self._write("cached.py", 'config = {"a": 1}')
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 1})
+        self.assertEqual(config.parse_config_file(py_path, cache_dir=self.cache_dir), {'a': 1})
+        # Same size, likely the same mtime; the contents hash catches it.
+        self._write("cached.json", '{"a": 2}')
+        self._write("cached.py", 'config = {"a": 2}')
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 2})
+        self.assertEqual(config.parse_config_file(py_path, cache_dir=self.cache_dir), {'a': 2})
+
+    def test_old_mtime_not_hashed(self):
+        json_path = self._write("cached.json", '{"a": 1}')
+        old = time.time() - 60
+        os.utime(json_path, (old, old))
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 1})
+        # Same size and mtime, long before the cache entry was written:
+        # the file isn't read again.
+        self._write("cached.json", '{"a": 2}')
+        os.utime(json_path, (old, old))
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 1})
+        os.utime(json_path, None)
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 2})
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), "No symlinks")
+    def test_symlink(self):
+        json_path = self._write("cached.json", '{"a": 1}')
+        link_path = os.path.join(self.cache_dir, "link.json")
+        os.symlink("cached.json", link_path)
+        config.parse_config_file(json_path, cache_dir=self.cache_dir)
+        num_files = len(os.listdir(self.cache_dir))
+        self.assertEqual(config.parse_config_file(link_path, cache_dir=self.cache_dir), {'a': 1})
+        self.assertEqual(len(os.listdir(self.cache_dir)), num_files)
+
+    def test_python_config_still_runs(self):
+        py_path = self._write("cached.py", 'import os\nconfig = {"cwd": os.getcwd()}')
+        config.parse_config_file(py_path, cache_dir=self.cache_dir)
+        os.chdir(self.cache_dir)
+        try:
+            cwd = os.getcwd()
+            self.assertEqual(config.parse_config_file("cached.py", cache_dir="."),
+                             {'cwd': cwd})
+        finally:
+            os.chdir("..")
+
+    def test_corrupt_cache(self):
+        json_path = self._write("cached.json", '{"a": 1}')
+        config.parse_config_file(json_path, cache_dir=self.cache_dir)
+        self._write(os.path.basename(config.query_config_cache_path(self.cache_dir, json_path)),
+                    'garbage')
+        self.assertEqual(config.parse_config_file(json_path, cache_dir=self.cache_dir), {'a': 1})
+
+    def test_multiple_config_files(self):
+        for i in range(2):
+            c = config.BaseConfig(initial_config_file='test/test.py')
+            c.parse_args(['--cfg', 'test/test_override.py,test/test_override2.py',
+                          '--config-cache-dir', self.cache_dir])
+            self.assertEqual(c._config['override_string'], 'yay')
+            self.assertEqual(c._config['override_list'], ['yay', 'worked'])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+
 class TestReadOnlyDict(unittest.TestCase):
     control_dict = {
         'b': '2',
@@ -179,6 +275,44 @@ class TestReadOnlyDict(unittest.TestCase):
         r = self.get_locked_ROD()
         self.assertRaises(AssertionError, r.clear)
 
+    def test_locked_nested(self):
+        r = self.get_locked_ROD()
+        self.assertRaises(AssertionError, r['c'].__setitem__, 'd', 5)
+        self.assertRaises(AssertionError, r['e'].append, 'h')
+        self.assertRaises(AssertionError, r['e'].__setitem__, 0, 'h')
+        self.assertRaises(AssertionError, r['e'].sort)
+        self.assertEqual(r, self.control_dict)
+        self.assertEqual(self.control_dict['e'], ['f', 'g'])
+        self.assertEqual(r['e'] + ['h'], ['f', 'g', 'h'])
+        self.assertEqual(json.loads(json.dumps(r)), self.control_dict)
+
+    def test_locked_copy(self):
+        r = self.get_locked_ROD()
+        c = copy.copy(r)
+        c['b'] = '3'
+        self.assertEqual(r['b'], '2')
+        self.assertTrue(c['c'] is r['c'])
+        c = copy.deepcopy(r)
+        c['c']['d'] = '5'
+        c['e'].append('x')
+        self.assertEqual(r['c'], {'d': '4'})
+        self.assertFalse('x' in r['e'])
+        self.assertRaises(AssertionError, r['c'].__setitem__, 'd', '5')
+        e = copy.deepcopy(r['e'])
+        e.append('x')
+        unlocked = copy.deepcopy(self.get_unlocked_ROD())
+        unlocked['c']['d'] = '5'
+        self.assertEqual(self.control_dict['c'], {'d': '4'})
+
+    def test_overlay(self):
+        r = self.get_locked_ROD()
+        o = r.overlay({'b': '3'}, h=[1])
+        self.assertEqual(o['b'], '3')
+        self.assertEqual(r['b'], '2')
+        self.assertTrue(o['c'] is r['c'])
+        self.assertRaises(AssertionError, o.__setitem__, 'b', '4')
+        self.assertRaises(AssertionError, o['h'].append, 2)
+
 
 class TestActions(unittest.TestCase):
     all_actions = ['a', 'b', 'c', 'd', 'e']
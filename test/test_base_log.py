@@ -1,9 +1,13 @@
+import gzip
 import os
+import re
 import shutil
 import subprocess
 import unittest
 
+import mozharness.base.errors as errors
 import mozharness.base.log as log
+from mozharness.base.log import ERROR, FATAL, INFO, WARNING
 
 tmp_dir = "test_log_dir"
 log_name = "test"
@@ -35,5 +39,285 @@ class TestLog(unittest.TestCase):
         self.assertTrue(os.path.exists(get_log_file_path()))
         del(l)
 
+    def test_async_log(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, async_log=True)
+        for i in range(5000):
+            l.log_message('line %d' % i)
+        l.log_message('bad line', level=ERROR)
+        l.log_message(u'caf\xe9')
+        l.flush()
+        info_lines = open(get_log_file_path(INFO)).read().splitlines()
+        self.assertEqual(len(info_lines), 5003)
+        self.assertTrue(info_lines[1].endswith(' - line 0'))
+        self.assertTrue(info_lines[-1].endswith(' - caf\xc3\xa9'))
+        error_lines = open(get_log_file_path(ERROR)).read().splitlines()
+        self.assertEqual(len(error_lines), 1)
+        self.assertRaises(SystemExit, l.log_message, 'boom', level=FATAL)
+        fatal_log = open(get_log_file_path(FATAL)).read()
+        self.assertTrue('Exiting -1' in fatal_log)
+        del(l)
+
+    def test_log_store(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, log_store=True)
+        l.log_message('an info line')
+        l.log_message('a warning line', level=WARNING)
+        l.log_message('an error line', level=ERROR)
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'test_store.log')))
+        self.assertFalse(os.path.exists(get_log_file_path(INFO)))
+        l.write_derived_logs()
+        info_lines = open(get_log_file_path(INFO)).read().splitlines()
+        self.assertEqual([line.split(' - ', 1)[1] for line in info_lines[1:]],
+                         ['an info line', 'a warning line', 'an error line'])
+        self.assertTrue(' WARNING - ' in info_lines[2])
+        warning_lines = open(get_log_file_path(WARNING)).read().splitlines()
+        self.assertEqual(len(warning_lines), 2)
+        raw_lines = open(get_log_file_path('raw')).read().splitlines()
+        self.assertEqual(raw_lines[1:], ['an info line', 'a warning line',
+                                         'an error line'])
+        self.assertEqual(sorted(l.log_files.keys()),
+                         sorted(['raw', INFO, WARNING, ERROR, 'critical',
+                                 FATAL]))
+        del(l)
+
+    def test_log_compression(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, log_compression='gzip')
+        self.assertEqual(l.log_files[INFO], 'test_info.log.gz')
+        l.log_message('first')
+        l.flush()
+        l.log_message('second')
+        l.flush()
+        info_log = gzip.open(get_log_file_path(INFO) + '.gz').read()
+        self.assertEqual([line.split(' - ', 1)[1] for line in info_log.splitlines()[1:]],
+                         ['first', 'second'])
+        del(l)
+
+
+class Unprintable(object):
+    def __str__(self):
+        raise AssertionError("Formatted a message that isn't logged!")
+
+
+class RecordList(object):
+    def __init__(self):
+        self.records = []
+
+    def is_enabled_for(self, level):
+        return level != log.IGNORE
+
+    def log_message(self, message, level=INFO, exit_code=-1):
+        self.records.append((message, level))
+
+
+class LazyLogObj(log.LogMixin):
+    def __init__(self, log_obj=None):
+        self.config = {'log_level': INFO}
+        self.log_obj = log_obj
+
+
+class TestLazyLogging(unittest.TestCase):
+    def setUp(self):
+        clean_log_dir()
+
+    def tearDown(self):
+        clean_log_dir()
+
+    def _fail(self):
+        self.fail("Formatted a message that isn't logged!")
+
+    def test_not_formatted_below_log_level(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False)
+        for log_obj in (None, l):
+            obj = LazyLogObj(log_obj=log_obj)
+            obj.debug(self._fail)
+            obj.debug("%s", Unprintable())
+            obj.log(self._fail, level=log.IGNORE)
+        del(l)
+
+    def test_formatted_at_log_level(self):
+        buf = RecordList()
+        obj = LazyLogObj(log_obj=buf)
+        obj.info("%s is now %s", 'FOO', 'bar')
+        obj.warning(lambda: "computed")
+        obj.info("100% done")
+        obj.log("%d%%", level=ERROR, args=(50,))
+        self.assertEqual([r[0] for r in buf.records],
+                         ['FOO is now bar', 'computed', '100% done', '50%'])
+
+    def test_log_obj_without_is_enabled_for(self):
+        messages = []
+
+        class MessageList(object):
+            def log_message(self, message, level=log.INFO, exit_code=-1):
+                messages.append(message)
+        obj = LazyLogObj(log_obj=MessageList())
+        obj.info("%s is now %s", 'FOO', 'bar')
+        obj.debug(self._fail)
+        self.assertEqual(messages, ['FOO is now bar'])
+
+
+class TestErrorListMatcher(unittest.TestCase):
+    lines = [
+        'make[2]: *** [libs] Error 2',
+        'make: *** No rule to make target `foo\'.  Stop.',
+        'foo.cpp:12: warning: unused variable',
+        'foo.cpp:12: error: expected ;',
+        'Traceback (most recent call last):',
+        '  raise VCSException: bad',
+        'abort: repository not found',
+        'no error here',
+        'Warning: Identity file not accessible',
+        'bash: foo: command not found',
+        '',
+    ]
+
+    def _walk(self, error_list, line):
+        for error_check in error_list:
+            if 'substr' in error_check:
+                if error_check['substr'] in line:
+                    return error_check
+            elif error_check['regex'].search(line):
+                return error_check
+
+    def test_same_as_walking_the_list(self):
+        for name in dir(errors):
+            error_list = getattr(errors, name)
+            if not name.endswith('ErrorList'):
+                continue
+            matcher = log.ErrorListMatcher(error_list)
+            for line in self.lines:
+                self.assertTrue(matcher.match(line) is self._walk(error_list, line),
+                                msg="%s: %s" % (name, line))
+
+    def test_first_match_wins(self):
+        error_list = [
+            {'regex': re.compile(r'error \d+'), 'level': WARNING},
+            {'substr': 'error', 'level': ERROR},
+        ]
+        matcher = log.ErrorListMatcher(error_list)
+        self.assertEqual(matcher.match('an error 12')['level'], WARNING)
+        self.assertEqual(matcher.match('an error')['level'], ERROR)
+        self.assertEqual(matcher.match('all good'), None)
+
+    def test_no_prefilter_for_ignorecase(self):
+        error_list = [{'regex': re.compile('error', re.I), 'level': ERROR}]
+        matcher = log.ErrorListMatcher(error_list)
+        self.assertEqual(matcher.prefilter, None)
+        self.assertEqual(matcher.match('ERROR')['level'], ERROR)
+
+    def test_regex_branch_literals(self):
+        error_list = [{'regex': re.compile(r'(TEST-UNEXPECTED|PROCESS-CRASH) \|'),
+                       'level': ERROR}]
+        matcher = log.ErrorListMatcher(error_list)
+        self.assertNotEqual(matcher.prefilter, None)
+        self.assertEqual(matcher.match('PROCESS-CRASH | foo')['level'], ERROR)
+        self.assertEqual(matcher.match('TEST-PASS | foo'), None)
+
+    def test_output_parser_recompiles(self):
+        parser = log.OutputParser(config={'log_level': ERROR},
+                                  error_list=[], log_output=False)
+        parser.add_lines('an error')
+        parser.error_list = [{'substr': 'error', 'level': ERROR}]
+        parser.add_lines('an error')
+        self.assertEqual(parser.num_errors, 1)
+
+
+class TestSummaryStore(unittest.TestCase):
+    def test_normalize_summary(self):
+        self.assertEqual(log.normalize_summary('/builds/slave/foo.cpp:12: error 0x1f'),
+                         '<path>:N: error N')
+        self.assertEqual(log.normalize_summary('Failed to add locale de!'),
+                         'Failed to add locale de!')
+
+    def test_duplicates_are_counted(self):
+        store = log.SummaryStore(max_exemplars=2)
+        for i in range(1000):
+            store.add('src/foo%d.cpp:%d: warning: unused' % (i, i), level=ERROR)
+        store.add('src/foo1.cpp:1: warning: unused')
+        entries = list(store)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['count'], 1000)
+        self.assertEqual(entries[0]['level'], ERROR)
+        self.assertEqual(entries[0]['exemplars'],
+                         ['src/foo0.cpp:0: warning: unused',
+                          'src/foo1.cpp:1: warning: unused'])
+        self.assertEqual(entries[1]['level'], INFO)
+        self.assertEqual(len(store), 1001)
+
+    def test_bounded(self):
+        store = log.SummaryStore(max_keys=3, max_message_length=10)
+        for word in ('one', 'two', 'three', 'four', 'five'):
+            store.add(word)
+        store.add('one')
+        store.add('x' * 100)
+        self.assertEqual([e['key'] for e in store], ['one', 'two', 'three'])
+        self.assertEqual(store.num_dropped, 3)
+        store = log.SummaryStore(max_message_length=10)
+        store.add('x' * 100)
+        self.assertEqual(list(store)[0]['exemplars'], ['x' * 10 + '...'])
+
+    def test_output_parser(self):
+        store = log.SummaryStore()
+        parser = log.OutputParser(config={}, summary_store=store, error_list=[
+            {'substr': 'boom', 'level': ERROR, 'summary': True},
+        ])
+        parser.add_lines(['boom 1', 'fine', 'boom 2'])
+        self.assertEqual([(e['count'], e['exemplars']) for e in store],
+                         [(2, ['boom 1', 'boom 2'])])
+
+
+class RecordingOutputParser(log.OutputParser):
+    def __init__(self, **kwargs):
+        self.logged = []
+        super(RecordingOutputParser, self).__init__(config={}, **kwargs)
+
+    def log(self, message, level=INFO, exit_code=-1):
+        self.logged.append((message.strip(), level))
+
+
+class TestContextLines(unittest.TestCase):
+    def test_parse_context_lines(self):
+        self.assertEqual(log.parse_context_lines('5:5'), (5, 5))
+        self.assertEqual(log.parse_context_lines('20:'), (20, 0))
+        self.assertEqual(log.parse_context_lines(':3'), (0, 3))
+        self.assertEqual(log.parse_context_lines(2), (2, 2))
+
+    def test_pre_and_post_context(self):
+        parser = RecordingOutputParser(error_list=[
+            {'substr': 'boom', 'level': ERROR, 'context_lines': '2:1'},
+        ])
+        parser.add_lines(['one', 'two', 'three', 'boom', 'four', 'five'])
+        self.assertEqual(len(parser.context_buffer), 2)
+        parser.finish()
+        self.assertEqual(parser.logged, [
+            ('one', INFO), ('two', ERROR), ('three', ERROR), ('boom', ERROR),
+            ('four', ERROR), ('five', INFO),
+        ])
+        self.assertEqual(parser.num_errors, 1)
+
+    def test_buffer_is_bounded(self):
+        parser = RecordingOutputParser(error_list=[
+            {'substr': 'boom', 'level': WARNING, 'context_lines': '3:'},
+        ])
+        parser.add_lines(['line %d' % i for i in range(100)])
+        self.assertEqual(len(parser.context_buffer), 3)
+        self.assertEqual(len(parser.logged), 97)
+
+    def test_fatal_is_not_held_back(self):
+        parser = RecordingOutputParser(error_list=[
+            {'substr': 'boom', 'level': FATAL, 'context_lines': '5:'},
+        ])
+        parser.add_lines(['one', 'boom'])
+        self.assertEqual(parser.logged, [('one', FATAL), ('boom', FATAL)])
+
+    def test_no_context_logs_immediately(self):
+        parser = RecordingOutputParser(error_list=errors.PythonErrorList)
+        parser.add_lines(['one'])
+        self.assertEqual(parser.logged, [('one', INFO)])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,11 @@
 import gc
+import gzip
 import mock
 import os
 import re
+import signal
+import threading
+import time
 import unittest
 PYWIN32 = False
 if os.name == 'nt':
@@ -177,6 +181,41 @@ class TestHelperFunctions(unittest.TestCase):
         contents = self.s.get_output_from_command(["bash", "-c", "cat %s" % self.temp_file])
         self.assertEqual(test_string, contents,
                          msg="get_output_from_command('cat file') differs from fh.write")
+        self.assertFalse(os.path.exists('tmpfile_stdout'))
+
+    def test_get_output_from_command_tmpfiles(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        contents = self.s.get_output_from_command(["bash", "-c", "cat %s" % self.temp_file],
+                                                  save_tmpfiles=True)
+        self.assertEqual(test_string, contents)
+        self.assertEqual(test_string, self.s.read_from_file('tmpfile_stdout'))
+
+    def test_get_output_from_command_head_tail(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        # Lots of stderr too, to make sure both pipes get drained.
+        command = ["bash", "-c", "head -c 200000 /dev/zero | tr '\\0' x >&2; seq 1 100000"]
+        self.assertEqual(self.s.get_output_from_command(command, silent=True,
+                                                        head_lines=2),
+                         "1\n2")
+        self.assertEqual(self.s.get_output_from_command(command, silent=True,
+                                                        tail_lines=2),
+                         "99999\n100000")
+        self.assertEqual(self.s.get_output_from_command(command, silent=True,
+                                                        head_lines=1,
+                                                        tail_lines=1),
+                         "1\n100000")
+
+    def test_iter_output_from_command(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        lines = list(self.s.iter_output_from_command(["cat", self.temp_file]))
+        self.assertEqual(lines, test_string.splitlines())
+        # Stopping early shouldn't wait for the command to finish.
+        start = time.time()
+        for line in self.s.iter_output_from_command(["bash", "-c", "echo hi; sleep 60"]):
+            break
+        self.assertTrue(time.time() - start < 30)
 
     def test_run_command(self):
         self._create_temp_file()
@@ -186,6 +225,340 @@ class TestHelperFunctions(unittest.TestCase):
                                             cwd="test_dir"), 0,
                          msg="run_command('cat file') did not exit 0")
 
+    def test_run_command_parse_at_end(self):
+        self._create_temp_file(contents="foo\nerror here\nbar\n")
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        error_list = [{'substr': 'error', 'level': ERROR}]
+        streamed = self.s.run_command(["cat", self.temp_file],
+                                      error_list=error_list,
+                                      return_type='num_errors')
+        spooled = self.s.run_command(["cat", self.temp_file],
+                                     error_list=error_list,
+                                     return_type='num_errors',
+                                     parse_at_end=True)
+        self.assertEqual(streamed, 1)
+        self.assertEqual(spooled, 1)
+
+    def test_run_command_parse_at_end_no_output(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.assertEqual(self.s.run_command(["true"], parse_at_end=True), 0)
+
+    def test_run_command_multiple_parsers(self):
+        self._create_temp_file(contents="foo\nerror here\nwarning here\n")
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        errors_parser = log.OutputParser(
+            config=self.s.config, log_obj=self.s.log_obj,
+            error_list=[{'substr': 'error', 'level': ERROR}])
+        warnings_parser = log.OutputParser(
+            config=self.s.config, log_obj=self.s.log_obj, log_output=False,
+            error_list=[{'substr': 'warning', 'level': WARNING}])
+        num_errors = self.s.run_command(["cat", self.temp_file],
+                                        output_parser=[errors_parser,
+                                                       warnings_parser],
+                                        return_type='num_errors')
+        self.assertEqual(num_errors, 1)
+        self.assertEqual((errors_parser.num_errors, errors_parser.num_warnings),
+                         (1, 0))
+        self.assertEqual((warnings_parser.num_errors, warnings_parser.num_warnings),
+                         (0, 1))
+
+    def test_run_command_capture_list(self):
+        self._create_temp_file(contents="buildid 1\nurl http://a/b\nbuildid 2\n")
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        capture_list = [
+            {'name': 'first', 'regex': re.compile(r'^buildid (\d+)')},
+            {'name': 'last', 'regex': re.compile(r'^buildid (\d+)'), 'keep': 'last'},
+            {'name': 'all', 'regex': re.compile(r'^(\w+) (\S+)'), 'keep': 'all'},
+            {'name': 'url', 'regex': re.compile(r'http://\S+')},
+            {'name': 'missing', 'regex': re.compile(r'^nope')},
+        ]
+        (status, captures) = self.s.run_command(["cat", self.temp_file],
+                                                capture_list=capture_list)
+        self.assertEqual(status, 0)
+        self.assertEqual(captures, {
+            'first': '1',
+            'last': '2',
+            'all': [('buildid', '1'), ('url', 'http://a/b'), ('buildid', '2')],
+            'url': 'http://a/b',
+            'missing': None,
+        })
+
+    def test_run_command_binary(self):
+        self._create_temp_file()
+        self.s = get_debug_script_obj()
+        status = self.s.run_command(["cat", self.temp_file], binary=True,
+                                    output_file='test_dir/copy')
+        self.assertEqual(status, 0)
+        self.assertEqual(self.s.read_from_file('test_dir/copy', verbose=False), test_string)
+        info_log = self.s.read_from_file('test_logs/test_info.log', verbose=False)
+        self.assertFalse('baz' in info_log)
+        self.assertTrue('Wrote %d bytes' % len(test_string) in info_log)
+        # By default the output goes to the raw log.
+        self.s.run_command(["cat", self.temp_file], binary=True)
+        raw_log = self.s.read_from_file('test_logs/test_raw.log', verbose=False)
+        self.assertTrue(test_string in raw_log)
+
+    def test_run_command_binary_compressed_logs(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'log_compression': 'gzip',
+                                           'work_dir': 'test_dir'},
+                                   initial_config_file='test/test.json')
+        self.s.info('a line')
+        self.s.run_command(["cat", self.temp_file], binary=True)
+        self.s.info('another line')
+        self.s.log_obj.flush()
+        # The compressed raw log is still readable, and the output went
+        # to a separate, plain log.
+        raw_log = gzip.open('test_logs/test_raw.log.gz').read()
+        self.assertTrue('another line' in raw_log)
+        self.assertFalse(test_string in raw_log)
+        binary_log = self.s.read_from_file('test_logs/test_binary.log',
+                                           verbose=False)
+        self.assertEqual(binary_log, test_string)
+        self.s.copy_logs_to_upload_dir()
+        upload_dir = 'test_dir/upload/logs'
+        self.assertTrue('test_binary.log.gz' in os.listdir(upload_dir))
+
+    def test_run_command_binary_log_store(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'log_store': True,
+                                           'async_log': True,
+                                           'work_dir': 'test_dir'},
+                                   initial_config_file='test/test.json')
+        self.s.run_command(["cat", self.temp_file], binary=True)
+        self.s.log_obj.flush()
+        self.s.log_obj.write_derived_logs()
+        # Rewriting the raw log from the store doesn't lose the output.
+        binary_log = self.s.read_from_file('test_logs/test_binary.log',
+                                           verbose=False)
+        self.assertEqual(binary_log, test_string)
+        self.assertFalse(test_string in self.s.read_from_file(
+            'test_logs/test_raw.log', verbose=False))
+
+    def test_run_command_binary_async_log(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(config={'log_type': 'simple',
+                                           'async_log': True,
+                                           'work_dir': 'test_dir'},
+                                   initial_config_file='test/test.json')
+        self.s.run_command(["cat", self.temp_file], binary=True)
+        self.s.log_obj.flush()
+        # The queued "Running command" line is written before the output.
+        log_contents = self.s.read_from_file('test_logs/test.log',
+                                             verbose=False)
+        self.assertTrue(log_contents.index('Running command') <
+                        log_contents.index(test_string))
+
+    def test_command_usage(self):
+        self.s = get_debug_script_obj()
+        self.s.current_action = 'test-action'
+        self.s.run_command(["bash", "-c", "exit 3"])
+        self.s.get_output_from_command(["true"])
+        self.assertEqual([(u['command'], u['action'], u['return_code'])
+                          for u in self.s.command_usage],
+                         [('bash -c "exit 3"', 'test-action', 3),
+                          ('true', 'test-action', 0)])
+        if hasattr(os, 'wait4'):
+            self.assertTrue(self.s.command_usage[0]['max_rss_kb'] > 0)
+        self.s.dump_command_usage(file_path='test_logs/command_usage.json')
+        contents = self.s.read_from_file('test_logs/command_usage.json',
+                                         verbose=False)
+        report = script.json.loads(contents)
+        self.assertEqual(report['actions']['test-action']['num_commands'], 2)
+        # A command killed by a signal returns minus the signal number,
+        # as with Popen.wait().
+        self.assertEqual(self.s.run_command(["bash", "-c", "kill -9 $$"]),
+                         -signal.SIGKILL)
+
+    def test_profile_action(self):
+        self.s = script.BaseScript(config={'cprofile_actions': True},
+                                   initial_config_file='test/test.json')
+        self.s.preflight_busy = lambda: None
+        self.s.busy = lambda: self.s.run_command(["true"])
+        self.s._profile_action('busy', 'busy')
+        self.assertEqual([(t['phase'], t['num_commands'])
+                          for t in self.s.action_timings],
+                         [('preflight_busy', 0), ('busy', 1)])
+        self.assertTrue(os.path.exists('test_logs/busy.pstats'))
+        timings = self.s.read_from_file('test_logs/action_timings.txt',
+                                        verbose=False)
+        self.assertTrue(timings.splitlines()[2].startswith('busy '))
+
+    def test_copy_logs_compressed(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'log_compression': 'gzip',
+                                           'work_dir': 'test_dir'},
+                                   initial_config_file='test/test.json')
+        self.s.info('a line')
+        self.s.dump_config()
+        self.s.dump_command_usage()
+        self.s.copy_logs_to_upload_dir()
+        upload_dir = 'test_dir/upload/logs'
+        # The logs are already compressed; the rest is compressed on the way.
+        expected = ['command_usage.json.gz', 'localconfig.json.gz']
+        for log_file in self.s.log_obj.log_files.values():
+            if not log_file.endswith('.gz'):
+                log_file += '.gz'
+            expected.append(log_file)
+        self.assertEqual(sorted(os.listdir(upload_dir)), sorted(expected))
+        info_log = gzip.open(os.path.join(upload_dir, 'test_info.log.gz')).read()
+        self.assertTrue(' - a line' in info_log)
+        usage = gzip.open(os.path.join(upload_dir, 'command_usage.json.gz')).read()
+        self.assertEqual(script.json.loads(usage)['commands'], [])
+
+    def test_copy_logs_without_command_usage(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'work_dir': 'test_dir'},
+                                   initial_config_file='test/test.json')
+        self.s.dump_config()
+        self.s.copy_logs_to_upload_dir()
+        info_log = self.s.read_from_file('test_logs/test_info.log',
+                                         verbose=False)
+        self.assertFalse(' ERROR - ' in info_log)
+        self.assertTrue(os.path.exists('test_dir/upload/logs/test_info.log'))
+
+    def test_log_index(self):
+        self.s = get_debug_script_obj()
+        self.s.action_message("Running build step.",
+                              index_entry={'action': 'build'})
+        self.s.run_command(["bash", "-c", "echo fine; echo oh no, an error; exit 1"],
+                           error_list=[{'substr': 'error', 'level': ERROR}])
+        self.s.warning("careful")
+        self.assertEqual(self.s.log_obj.log_files['index'], 'test_debug.log.index')
+        log_contents = self.s.read_from_file('test_logs/test_debug.log',
+                                             verbose=False)
+        index = [script.json.loads(line) for line in
+                 self.s.read_from_file('test_logs/test_debug.log.index',
+                                       verbose=False).splitlines()]
+        self.assertEqual([sorted(set(entry.keys()) - set(['offset', 'line']))
+                          for entry in index],
+                         [['action', 'level'], ['command', 'level'],
+                          ['level', 'pattern'], ['level', 'return_code'],
+                          ['level']])
+        lines = log_contents.splitlines()
+        for entry in index:
+            line = log_contents[entry['offset']:].split('\n', 1)[0]
+            self.assertEqual(line, lines[entry['line'] - 1])
+        self.assertTrue(index[0]['level'] == 'info' and
+                        log_contents[index[0]['offset']:].split('\n', 1)[0].endswith(
+                            '##### Running build step.'))
+        self.assertEqual(index[2]['pattern'], 'error')
+        self.assertTrue(lines[index[2]['line'] - 1].endswith(' oh no, an error'))
+        self.assertEqual(index[3]['return_code'], 1)
+
+    def test_trace(self):
+        self.s = script.BaseScript(config={'trace': True,
+                                           'trace_phase_markers': ['^phase ']},
+                                   initial_config_file='test/test.json')
+        self.s.run_command(["bash", "-c",
+                            "echo phase one; sleep 0.1; echo other; echo phase two"])
+        self.s.dump_trace()
+        contents = self.s.read_from_file('test_logs/trace.json', verbose=False)
+        events = script.json.loads(contents)['traceEvents']
+        self.assertEqual([(e['cat'], e['name']) for e in events],
+                         [('command', 'bash -c "echo phase one; sleep 0.1; echo other; echo phase two"'),
+                          ('phase', 'phase one'), ('phase', 'phase two')])
+        self.assertTrue(events[1]['dur'] >= 100000)
+
+    def test_run_command_abort(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        error_list = [{'substr': 'doomed', 'level': ERROR, 'abort': True}]
+        parser = log.OutputParser(config=self.s.config, log_obj=self.s.log_obj,
+                                  error_list=error_list)
+        start = time.time()
+        # The backgrounded sleep keeps the pipe open unless the whole
+        # process group gets killed.
+        status = self.s.run_command(
+            ["bash", "-c", "echo doomed; sleep 60 & sleep 60; echo never"],
+            output_parser=parser, abort_grace_period=0)
+        self.assertTrue(time.time() - start < 30)
+        self.assertNotEqual(status, 0)
+        self.assertEqual(parser.num_errors, 1)
+        self.assertEqual(parser.abort_line, 'doomed')
+
+    def test_run_command_abort_forwards_signals(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        error_list = [{'substr': 'doomed', 'level': ERROR, 'abort': True}]
+        script._install_signal_forwarding()
+        received = []
+        # Stand in for the default handler, which would kill us.
+        with mock.patch.dict(script._previous_signal_handlers,
+                             {signal.SIGTERM: lambda *args: received.append(args[0])}):
+            threading.Timer(1, os.kill, [os.getpid(), signal.SIGTERM]).start()
+            start = time.time()
+            # The command is in a process group of its own, so it only
+            # dies if our SIGTERM is passed on.
+            status = self.s.run_command(["bash", "-c", "sleep 60 & sleep 60"],
+                                        error_list=error_list)
+        self.assertTrue(time.time() - start < 30)
+        self.assertNotEqual(status, 0)
+        self.assertEqual(received, [signal.SIGTERM])
+
+    def test_run_command_output_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        start = time.time()
+        status = self.s.run_command(["bash", "-c", "echo hi; sleep 60 & sleep 60"],
+                                    output_timeout=1)
+        self.assertTrue(time.time() - start < 30)
+        self.assertEqual(status, script.TIMEOUT_STATUS)
+
+    @unittest.skipIf(os.name == "nt", "Not for Windows")
+    def test_process_group(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        output = self.s.get_output_from_command(
+            "echo $$; ps -o pgid= -p $$", output_timeout=30)
+        pid, pgid = output.split()
+        self.assertEqual(pid, pgid)
+        self.assertNotEqual(int(pgid), os.getpgrp())
+        status = self.s.run_command(["no-such-command-here"], output_timeout=30)
+        self.assertEqual(status, 127)
+
+    def test_run_command_max_run_time(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        start = time.time()
+        num_errors = self.s.run_command(
+            ["bash", "-c", "while true; do echo hi; sleep 0.1; done"],
+            max_run_time=1, output_timeout=10, parse_at_end=True,
+            return_type='num_errors')
+        self.assertTrue(time.time() - start < 30)
+        self.assertEqual(num_errors, 1)
+
+    def test_get_output_from_command_output_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        start = time.time()
+        output = self.s.get_output_from_command(["bash", "-c", "echo hi; sleep 60"],
+                                                output_timeout=1)
+        self.assertTrue(time.time() - start < 30)
+        self.assertEqual(output, script.TIMEOUT_STATUS)
+        # No output at all is something else.
+        output = self.s.get_output_from_command(["true"], output_timeout=30)
+        self.assertEqual(output, None)
+        self.assertRaises(script.subprocess.CalledProcessError,
+                          self.s.get_output_from_command,
+                          ["bash", "-c", "sleep 60"], max_run_time=1,
+                          throw_exception=True)
+
+    @unittest.skipIf(os.name == "nt", "Not for Windows")
+    def test_get_output_from_command_escaped_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.s.mkdir_p('test_dir')
+        start = time.time()
+        # The setsid'd sleep escapes the process group kill, and keeps
+        # stdout open.
+        output = self.s.get_output_from_command(
+            ["bash", "-c", "setsid bash -c 'echo $$ >test_dir/pid; exec sleep 20' & sleep 20"],
+            output_timeout=1)
+        self.assertTrue(time.time() - start < 15)
+        self.assertEqual(output, script.TIMEOUT_STATUS)
+        os.kill(int(self.s.read_from_file('test_dir/pid', verbose=False)),
+                signal.SIGKILL)
+        # Let the collector threads, which refer to self.s, see EOF.
+        end_time = time.time() + 5
+        while threading.active_count() > 1 and time.time() < end_time:
+            time.sleep(0.1)
+
     def test_move1(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -359,6 +732,21 @@ class TestScriptLogging(unittest.TestCase):
             msg += "summary() didn't log to warning!\n"
         self.assertEqual(msg, "", msg=msg)
 
+    def test_summary_dedup(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'summary_exemplars': 1},
+                                   initial_config_file='test/test.json')
+        for i in range(100):
+            self.s.add_summary('foo.cpp:%d: error' % i, level=ERROR)
+        self.s.run_command(['echo', 'obj/foo.o: boom'],
+                           error_list=[{'substr': 'boom', 'level': ERROR,
+                                        'summary': True}])
+        self.s.summary()
+        error_lines = self.s.read_from_file("test_logs/test_error.log",
+                                            verbose=False).splitlines()
+        self.assertTrue(error_lines[-2].endswith(' ERROR -    100x foo.cpp:0: error'))
+        self.assertTrue(error_lines[-1].endswith(' ERROR - obj/foo.o: boom'))
+
     def _test_log_level(self, log_level, log_level_file_list):
         self.s = script.BaseScript(config={'log_type': 'multi'},
                                    initial_config_file='test/test.json')
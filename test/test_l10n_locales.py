@@ -6,7 +6,9 @@ import unittest
 
 import mozharness.base.log as log
 import mozharness.base.script as script
+from mozharness.base.config import ReadOnlyDict
 import mozharness.mozilla.l10n.locales as locales
+from mozharness.mozilla.l10n.multi_locale_build import MultiLocaleBuild
 
 ALL_LOCALES = ['ar', 'be', 'de', 'es-ES']
 
@@ -128,5 +130,50 @@ class TestLocalesMixin(unittest.TestCase):
         expected_dirs.sort()
         self.assertEqual(dirs, expected_dirs)
 
+
+class TestLockedConfig(unittest.TestCase):
+    """The script config is locked all the way down; make sure we don't
+    change it in place.
+    """
+    repos = [{'repo': '%(user_repo_override)s/mozilla-beta', 'dest': 'mozilla-beta'}]
+
+    def setUp(self):
+        cleanup()
+        self.l = LocalesTest()
+        self.checked_out = []
+        self.l.vcs_checkout_repos = self._vcs_checkout_repos
+
+    def tearDown(self):
+        cleanup()
+
+    def _vcs_checkout_repos(self, repo_list, **kwargs):
+        self.checked_out.extend([r['repo'] for r in repo_list])
+        return {}
+
+    def _lock(self, config):
+        self.l.config = ReadOnlyDict(config).lock()
+
+    def test_query_locales(self):
+        self._lock({'locales': ['a', 'b', 'c'], 'ignore_locales': ['b'],
+                    'additional_locales': ['d']})
+        self.assertEqual(self.l.query_locales(), ['a', 'c', 'd'])
+        self.assertEqual(self.l.config['locales'], ['a', 'b', 'c'])
+
+    def test_pull_locale_source(self):
+        self._lock({'locales': ['de'], 'l10n_repos': self.repos,
+                    'user_repo_override': 'users/foo',
+                    'hg_l10n_base': 'http://hg/%(user_repo_override)s'})
+        self.l.pull_locale_source(parent_dir='test_logs')
+        self.assertEqual(self.checked_out, ['users/foo/mozilla-beta',
+                                            'http://hg/users/foo/de'])
+        self.assertEqual(self.l.config['l10n_repos'], self.repos)
+
+    def test_multi_locale_pull_build_source(self):
+        self._lock({'repos': self.repos, 'user_repo_override': 'users/foo'})
+        MultiLocaleBuild.pull_build_source.im_func(self.l)
+        self.assertEqual(self.checked_out, ['users/foo/mozilla-beta'])
+        self.assertEqual(self.l.config['repos'], self.repos)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+import imp
+import mock
+import os
+import shutil
+import sys
+import unittest
+
+from mozharness.base.log import INFO, WARNING, ERROR, CRITICAL, FATAL
+
+reparse_log = imp.load_source('reparse_log', 'scripts/reparse_log.py')
+
+test_dir = 'test_dir'
+log_path = os.path.join(test_dir, 'fixture_raw.log')
+
+
+def write_fixture_log():
+    lines = []
+    for i in range(500):
+        if i % 37 == 0:
+            lines.append('Traceback (most recent call last):')
+        elif i % 53 == 0:
+            lines.append(' raise VCSException: line %d' % i)
+        else:
+            lines.append(' ordinary line %d' % i)
+    fh = open(log_path, 'w')
+    fh.write('\n'.join(lines) + '\n')
+    fh.close()
+
+
+class TestReparseLog(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree(test_dir, ignore_errors=True)
+        os.makedirs(test_dir)
+        write_fixture_log()
+
+    def tearDown(self):
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    def test_query_log_chunks(self):
+        size = os.path.getsize(log_path)
+        contents = open(log_path).read()
+        for num_chunks in (1, 2, 3, 7, 1000):
+            chunks = reparse_log.query_log_chunks(log_path, num_chunks)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], size)
+            self.assertTrue(len(chunks) <= num_chunks)
+            for (start, end), (next_start, _) in zip(chunks, chunks[1:]):
+                self.assertEqual(end, next_start)
+                self.assertEqual(contents[next_start - 1], '\n')
+
+    def test_summary_collector(self):
+        collector = reparse_log.SummaryCollector()
+        self.assertFalse(collector.is_enabled_for(INFO))
+        for level in (INFO, WARNING, ERROR, CRITICAL, FATAL):
+            collector.log_message(level, level=level)
+        self.assertEqual(collector.summary,
+                         [(level, level) for level in
+                          (WARNING, ERROR, CRITICAL, FATAL)])
+
+    def reparse(self, jobs):
+        argv = ['reparse_log.py', '--log-file', log_path,
+                '--error-list', 'PythonErrorList', '--jobs', str(jobs),
+                '--base-work-dir', os.path.abspath(test_dir)]
+        with mock.patch.object(sys, 'argv', argv):
+            r = reparse_log.ReparseLog()
+        logged = []
+        r.log = lambda message, level=INFO, **kwargs: \
+            logged.append((level, message))
+        r.reparse()
+        del(r)
+        return logged
+
+    def test_reparse_jobs(self):
+        logged = self.reparse(1)
+        self.assertEqual(logged[-1],
+                         (INFO, '%s: 23 errors, 0 warnings, worst log level critical.' %
+                          log_path))
+        self.assertEqual(self.reparse(2)[1:], logged[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+
+from mozharness.base.config import ReadOnlyDict
+from mozharness.mozilla.testing.talos import Talos
+
+
+class LockedTalos(object):
+    tests = None
+
+    def __init__(self, config):
+        self.config = ReadOnlyDict(config).lock()
+
+
+class TestTalos(unittest.TestCase):
+    def test_query_tests_locked_config(self):
+        t = LockedTalos({'use_talos_json': False, 'tests': ['ts', 'a11yr'],
+                         'ignore_tests': ['a11yr']})
+        self.assertEqual(Talos.query_tests.im_func(t), ['ts'])
+        self.assertEqual(t.config['tests'], ['ts', 'a11yr'])
+
+
+if __name__ == '__main__':
+    unittest.main()